@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""Routines for bosonic manybody systems in the occupation-number basis.
+
+A state of n bosons in d modes is represented by its coefficients w.r.t. the
+occupation-number states |n_1,...,n_d> with sum_j n_j = n. Hence, only
+(n + d - 1 choose n) coefficients are required instead of the d^n entries of
+the full tensor representation used by :func:`qstat.symmtensor`.
+
+The occupation states with fixed particle number are enumerated by mapping
+the sorted list of occupied modes k_1 <= ... <= k_n to the strictly increasing
+sequence c_i = k_i + i - 1 and ranking it in the combinatorial number system.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import gammaln
+
+from .qstat import binomials, rank_combinations, unrank_combinations
+
+
+def basis_dim(nr_modes, nr_bosons):
+    """Returns the number (n + d - 1 choose n) of occupation-number states of
+    n bosons in d modes.
+
+    :param nr_modes: Number d of single-particle modes
+    :param nr_bosons: Number n of bosons
+    :returns: Dimension of the symmetric subspace
+
+    """
+    size = nr_bosons + nr_modes - 1
+    if size < 0:
+        return 1
+    return int(binomials(size)[size, nr_bosons])
+
+
+def occupation_rank(occupations):
+    """Computes the index of the occupation-number states `occupations` in the
+    basis returned by :func:`occupation_basis`.
+
+    :param occupations: Integer array of shape (..., d) with rows
+                        (n_1, ..., n_d) summing to the same number n
+    :returns: Integer array of shape occupations.shape[:-1]
+
+    """
+    occupations = np.asarray(occupations, dtype=np.int64)
+    nr_modes = occupations.shape[-1]
+    nr_bosons = int(occupations.sum(axis=-1).max()) if occupations.size else 0
+    if nr_bosons == 0:
+        return np.zeros(occupations.shape[:-1], dtype=np.int64)
+
+    # k_i = number of modes m with n_1 + ... + n_m <= i
+    cumulative = np.cumsum(occupations, axis=-1)
+    modes = (cumulative[..., :, None] <= np.arange(nr_bosons)).sum(axis=-2)
+    return rank_combinations(modes + np.arange(nr_bosons),
+                              nr_bosons + nr_modes - 1)
+
+
+def occupation_unrank(ranks, nr_modes, nr_bosons):
+    """Inverse of :func:`occupation_rank`.
+
+    :param ranks: Integer array of indices in the occupation-number basis
+    :param nr_modes: Number d of single-particle modes
+    :param nr_bosons: Number n of bosons
+    :returns: Integer array of shape ranks.shape + (d,)
+
+    """
+    combs = unrank_combinations(ranks, nr_bosons, nr_bosons + nr_modes - 1)
+    modes = combs - np.arange(nr_bosons)
+    return (modes[..., None] == np.arange(nr_modes)).sum(axis=-2)
+
+
+def occupation_basis(nr_modes, nr_bosons):
+    """Returns the occupation-number basis of n bosons in d modes.
+
+    :param nr_modes: Number d of single-particle modes
+    :param nr_bosons: Number n of bosons
+    :returns: Integer array of shape ((n + d - 1 choose n), d), where the
+              i-th row contains the occupation numbers of the i-th basis state
+
+    """
+    dim = basis_dim(nr_modes, nr_bosons)
+    return occupation_unrank(np.arange(dim), nr_modes, nr_bosons)
+
+
+def annhilation_operators(nr_modes, max_bosons):
+    """Computes the sparse-matrix representations of the annhilators a_j on
+    the truncated Fock space containing all states with at most `max_bosons`
+    bosons. The basis consists of the bases from :func:`occupation_basis`
+    for 0, 1, ..., `max_bosons` particles (in this order) and
+
+            a_j |..., n_j, ...> = sqrt(n_j) |..., n_j - 1, ...>.
+
+    The creators are given by the adjoints adj(a)_j = a_j.T. Note that due to
+    the truncation, the canonical commutation relations only hold on states
+    with less than `max_bosons` particles.
+
+    :param nr_modes: Number d of single-particle modes
+    :param max_bosons: Maximal number of bosons
+    :returns: List of length d, where the j-th entry is the sparse matrix
+              representation of a_j
+
+    """
+    dims = [basis_dim(nr_modes, n) for n in range(max_bosons + 1)]
+    offsets = np.concatenate(([0], np.cumsum(dims)))
+    triplets = [([], [], []) for _ in range(nr_modes)]
+
+    for nr_bosons in range(1, max_bosons + 1):
+        basis = occupation_basis(nr_modes, nr_bosons)
+        for mode, (rows, cols, data) in enumerate(triplets):
+            sel = np.flatnonzero(basis[:, mode] > 0)
+            lowered = basis[sel].copy()
+            lowered[:, mode] -= 1
+            rows.append(offsets[nr_bosons - 1] + occupation_rank(lowered))
+            cols.append(offsets[nr_bosons] + sel)
+            data.append(np.sqrt(basis[sel, mode]))
+
+    shape = (offsets[-1], offsets[-1])
+    return [sp.csr_matrix((np.concatenate(data), (np.concatenate(rows),
+                                                  np.concatenate(cols))),
+                          shape=shape)
+            if len(data) > 0 else sp.csr_matrix(shape)
+            for rows, cols, data in triplets]
+
+
+def tensor_embedding(nr_modes, nr_bosons):
+    """Computes the isometry mapping the occupation-number basis to the full
+    tensor representation used by :func:`qstat.tensor` (with xs[0] being the
+    innermost factor). The columns are the normalized states
+
+        |n_1,...,n_d> = sqrt(n! / prod_j n_j!) * symmtensor(e_{k_1}, ..., e_{k_n})
+
+    where k_1 <= ... <= k_n are the occupied modes.
+
+    :param nr_modes: Number d of single-particle modes
+    :param nr_bosons: Number n of bosons
+    :returns: Sparse matrix of shape (d^n, (n + d - 1 choose n)) in CSR format
+
+    """
+    full_dim = nr_modes**nr_bosons
+    indices = np.arange(full_dim, dtype=np.int64)
+    occupations = np.zeros((full_dim, nr_modes), dtype=np.int64)
+    for site in range(nr_bosons):
+        digits = (indices // nr_modes**site) % nr_modes
+        occupations[indices, digits] += 1
+
+    weights = np.exp(0.5 * (np.sum(gammaln(occupations + 1), axis=-1)
+                            - gammaln(nr_bosons + 1)))
+    return sp.csr_matrix((weights, (indices, occupation_rank(occupations))),
+                         shape=(full_dim, basis_dim(nr_modes, nr_bosons)))
+
+
+def to_tensor(coeffs, nr_modes, nr_bosons):
+    """Converts states from the occupation-number basis to the full tensor
+    representation (see :func:`tensor_embedding`).
+
+    :param coeffs: Vector of size (n + d - 1 choose n) or array of shape
+                   (k, (n + d - 1 choose n)) containing k states as rows
+    :param nr_modes: Number d of single-particle modes
+    :param nr_bosons: Number n of bosons
+    :returns: Array of shape (d^n,) or (k, d^n), respectively
+
+    """
+    embedding = tensor_embedding(nr_modes, nr_bosons)
+    return embedding.dot(np.asarray(coeffs).T).T
+
+
+def from_tensor(psi, nr_modes, nr_bosons):
+    """Converts states from the full tensor representation to the
+    occupation-number basis. If `psi` is not symmetric, the coefficients of
+    its projection onto the symmetric subspace are returned.
+
+    :param psi: Vector of size d^n or array of shape (k, d^n) containing k
+                states as rows
+    :param nr_modes: Number d of single-particle modes
+    :param nr_bosons: Number n of bosons
+    :returns: Array of shape ((n + d - 1 choose n),) or
+              (k, (n + d - 1 choose n)), respectively
+
+    """
+    embedding = tensor_embedding(nr_modes, nr_bosons)
+    return embedding.T.dot(np.asarray(psi).T).T
@@ -3,15 +3,50 @@
 """Routines for sampling from the Haar measures of the classical compact
 groups. Algorithms taken from http://arxiv.org/abs/math-ph/0609050.
 
-TODO Symplectic groups are missing
+All samplers take either a `randn` function or a numpy.random.Generator
+`rng`. For reproducible parallel sampling, use `sample_parallel`, which draws
+every chunk from an independent stream spawned from a single seed.
 """
 
 from __future__ import division, print_function
+import os
 import numpy as np
-from scipy.linalg import qr, eigvals
+from concurrent.futures import ProcessPoolExecutor
+from scipy.linalg import qr
 
 
-def orthogonal(dim, randn=np.random.randn):
+def _haar_from_gaussian(z):
+    """Computes the QR decomposition of the (stack of) Gaussian matrices `z`
+    and corrects the phases such that the diagonal of r is positive, which
+    renders q Haar distributed.
+
+    :param z: Array of shape (dim, dim) or (size, dim, dim)
+    :returns: Array of same shape as `z`
+
+    """
+    if z.ndim == 2:
+        q, r = qr(z)
+    else:
+        q, r = np.linalg.qr(z)
+    d = np.diagonal(r, axis1=-2, axis2=-1)
+    ph = d / np.abs(d)
+    return q * ph[..., None, :]
+
+
+def _randn(randn, rng):
+    """Returns a randn-like function drawing from the Generator `rng` (or
+    `randn` itself if `rng` is None)"""
+    if rng is None:
+        return randn
+    return lambda *shape: rng.standard_normal(shape)
+
+
+def _shape(dim, size):
+    """Shape of `size` stacked (dim, dim) matrices (or of a single one)"""
+    return (dim, dim) if size is None else (size, dim, dim)
+
+
+def orthogonal(dim, randn=np.random.randn, size=None, rng=None):
     """Returns a sample from the Gaussian orthogonal ensemble of given
     dimension.  (i.e. the haar measure on U(dim)).
 
@@ -19,15 +54,16 @@ def orthogonal(dim, randn=np.random.randn):
     :param randn: Function to create real N(0,1) distributed random variables.
         It should take the shape of the output as numpy.random.randn does
         (default: numpy.random.randn)
+    :param int size: Number of samples; if given, a stack of shape
+        (size, dim, dim) is returned (default: None, i.e. a single sample)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
     """
-    z = randn(dim, dim)
-    q, r = qr(z)
-    d = np.diagonal(r)
-    ph = d / np.abs(d)
-    return q * ph
+    z = _randn(randn, rng)(*_shape(dim, size))
+    return _haar_from_gaussian(z)
 
 
-def unitary(dim, randn=np.random.randn):
+def unitary(dim, randn=np.random.randn, size=None, rng=None):
     """Returns a sample from the Gaussian unitary ensemble of given dimension.
     (i.e. the haar measure on U(dim)).
 
@@ -35,40 +71,473 @@ def unitary(dim, randn=np.random.randn):
     :param randn: Function to create real N(0,1) distributed random variables.
         It should take the shape of the output as numpy.random.randn does
         (default: numpy.random.randn)
+    :param int size: Number of samples; if given, a stack of shape
+        (size, dim, dim) is returned (default: None, i.e. a single sample)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
     """
-    z = (randn(dim, dim) + 1j * randn(dim, dim)) / np.sqrt(2.0)
-    q, r = qr(z)
-    d = np.diagonal(r)
-    ph = d / np.abs(d)
-    return q * ph
+    randn = _randn(randn, rng)
+    shape = _shape(dim, size)
+    z = (randn(*shape) + 1j * randn(*shape)) / np.sqrt(2.0)
+    return _haar_from_gaussian(z)
 
 
-#############
-#  Tesing   #
-#############
-LEVEL_SPACING_DF = {'orthogonal': lambda s: np.pi / 2 * s * np.exp(-np.pi / 4 * s**2),
-                    'unitary': lambda s: 32 / np.pi**2 * s**2 * np.exp(-4 / np.pi * s**2)
+def _symplectic_form(dim):
+    """Returns J = ((0, I), (-I, 0)) of shape (dim, dim)"""
+    half = dim // 2
+    J = np.zeros((dim, dim))
+    J[:half, half:] = np.identity(half)
+    J[half:, :half] = -np.identity(half)
+    return J
+
+
+def symplectic(dim, randn=np.random.randn, size=None, rng=None):
+    """Returns a sample from the haar measure on the compact symplectic group
+    USp(dim) = {S in U(dim): S^T J S = J} with J = ((0, I), (-I, 0)).
+
+    The columns are generated by Gram-Schmidt orthonormalization of Gaussian
+    vectors v_k, where each new column v_k is completed by -J * conj(v_k) (the
+    "quaternionic partner" of v_k). Since this procedure commutes with the
+    action of USp(dim) and the Gaussian distribution is invariant, the result
+    is Haar distributed.
+
+    :param int dim: Dimension; has to be even
+    :param randn: Function to create real N(0,1) distributed random variables.
+        It should take the shape of the output as numpy.random.randn does
+        (default: numpy.random.randn)
+    :param int size: Number of samples; if given, a stack of shape
+        (size, dim, dim) is returned (default: None, i.e. a single sample)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
+    """
+    if dim % 2 != 0:
+        raise ValueError("ccg_haar.py:symplectic: Dimension has to be even.")
+
+    half = dim // 2
+    randn = _randn(randn, rng)
+    shape = (dim, half) if size is None else (size, dim, half)
+    z = (randn(*shape) + 1j * randn(*shape)) / np.sqrt(2.0)
+    res = np.zeros(_shape(dim, size), dtype=complex)
+
+    for k in range(half):
+        v = z[..., k]
+        basis = np.concatenate((res[..., :k], res[..., half:half + k]),
+                               axis=-1)
+        # orthogonalize twice for numerical stability
+        for _ in range(2):
+            v = v - np.einsum('...ij,...j->...i', basis,
+                              np.einsum('...ji,...j->...i', basis.conj(), v))
+        v = v / np.linalg.norm(v, axis=-1, keepdims=True)
+        res[..., k] = v
+        res[..., half + k] = np.concatenate((-v[..., half:], v[..., :half]),
+                                            axis=-1).conj()
+    return res
+
+
+def circular_orthogonal(dim, randn=np.random.randn, size=None, rng=None):
+    """Returns a sample from the circular orthogonal ensemble (COE), i.e.
+    U^T U with U distributed according to the haar measure on U(dim).
+
+    :param int dim: Dimension
+    :param randn: Function to create real N(0,1) distributed random variables.
+        It should take the shape of the output as numpy.random.randn does
+        (default: numpy.random.randn)
+    :param int size: Number of samples; if given, a stack of shape
+        (size, dim, dim) is returned (default: None, i.e. a single sample)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
+    """
+    u = unitary(dim, randn=randn, size=size, rng=rng)
+    return np.matmul(np.swapaxes(u, -1, -2), u)
+
+
+def circular_unitary(dim, randn=np.random.randn, size=None, rng=None):
+    """Returns a sample from the circular unitary ensemble (CUE), which is
+    the haar measure on U(dim), see `unitary`.
+    """
+    return unitary(dim, randn=randn, size=size, rng=rng)
+
+
+def circular_symplectic(dim, randn=np.random.randn, size=None, rng=None):
+    """Returns a sample from the circular symplectic ensemble (CSE), i.e.
+    U^R U with U distributed according to the haar measure on U(dim) and the
+    quaternion dual U^R = J^T U^T J. Every eigenvalue is doubly degenerate.
+
+    :param int dim: Dimension; has to be even
+    :param randn: Function to create real N(0,1) distributed random variables.
+        It should take the shape of the output as numpy.random.randn does
+        (default: numpy.random.randn)
+    :param int size: Number of samples; if given, a stack of shape
+        (size, dim, dim) is returned (default: None, i.e. a single sample)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
+    """
+    if dim % 2 != 0:
+        raise ValueError("ccg_haar.py:circular_symplectic: Dimension has to "
+                         "be even.")
+
+    J = _symplectic_form(dim)
+    u = unitary(dim, randn=randn, size=size, rng=rng)
+    dual = np.matmul(np.matmul(J.T, np.swapaxes(u, -1, -2)), J)
+    return np.matmul(dual, u)
+
+
+def sample_chunks(sampler, dim, samples, chunksize=1000, **kwargs):
+    """Generator yielding `samples` samples of `sampler` in stacks of at most
+    `chunksize` samples, so arbitrarily many samples can be processed with
+    bounded memory.
+
+    :param sampler: Sampling function such as `unitary` or `orthogonal`
+    :param int dim: Dimension
+    :param int samples: Total number of samples
+    :param int chunksize: Maximal number of samples per chunk (default 1000)
+    :param kwargs: Passed to `sampler`
+    :returns: Generator of arrays of shape (<=chunksize, dim, dim)
+    """
+    for start in range(0, samples, chunksize):
+        yield sampler(dim, size=min(chunksize, samples - start), **kwargs)
+
+
+def spawn_rngs(seed, nr_streams):
+    """Returns `nr_streams` statistically independent random generators
+    spawned from a single seed using numpy.random.SeedSequence.
+
+    :param seed: Seed (anything accepted by numpy.random.SeedSequence)
+    :param int nr_streams: Number of generators
+    :returns: List of numpy.random.Generator
+    """
+    children = np.random.SeedSequence(seed).spawn(nr_streams)
+    return [np.random.default_rng(child) for child in children]
+
+
+def _sample_chunk(size, rng, sampler, dim, kwargs):
+    """Draws a chunk of `size` samples using the Generator `rng`; executed in
+    the worker processes of `sample_parallel`."""
+    return sampler(dim, size=size, rng=rng, **kwargs)
+
+
+def _map_chunks(func, samples, chunksize, seed, processes, *args):
+    """Evaluates func(size, rng, *args) for consecutive chunks of `samples`
+    in a process pool, where the i-th chunk always uses the i-th stream
+    spawned from `seed`. The results are yielded in order and at most twice
+    the number of processes are pending at any time.
+    """
+    sizes = [min(chunksize, samples - start)
+             for start in range(0, samples, chunksize)]
+    seed_seqs = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    processes = os.cpu_count() if processes is None else processes
+    with ProcessPoolExecutor(processes) as executor:
+        pending = []
+        for size, seed_seq in zip(sizes, seed_seqs):
+            rng = np.random.default_rng(seed_seq)
+            pending.append(executor.submit(func, size, rng, *args))
+            if len(pending) >= 2 * processes:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def sample_parallel(sampler, dim, samples, seed=None, chunksize=1000,
+                    processes=None, **kwargs):
+    """Same as `sample_chunks`, but the chunks are sampled in a process pool.
+    The i-th chunk is always drawn from the i-th stream spawned from `seed`,
+    so the result is bit-reproducible for a given seed and chunksize
+    independent of the number of processes. The chunks are yielded in order
+    and at most twice the number of processes are kept in memory.
+
+    :param sampler: Module-level sampling function accepting the `size` and
+        `rng` arguments such as `unitary` or `symplectic`
+    :param int dim: Dimension
+    :param int samples: Total number of samples
+    :param seed: Seed for numpy.random.SeedSequence (default: None, i.e. fresh
+        entropy from the OS)
+    :param int chunksize: Maximal number of samples per chunk (default 1000)
+    :param int processes: Number of worker processes (default: None, i.e. the
+        number of CPUs)
+    :param kwargs: Passed to `sampler`
+    :returns: Generator of arrays of shape (<=chunksize, dim, dim)
+    """
+    return _map_chunks(_sample_chunk, samples, chunksize, seed, processes,
+                       sampler, dim, kwargs)
+
+
+class HouseholderUnitary(object):
+
+    """Factored representation of a Haar-random unitary (or orthogonal)
+    matrix as a product of Householder reflections and a diagonal phase matrix
+
+            U = H_0 * H_1 * ... * H_{dim-2} * diag(phases)
+
+    where H_k = I - 2 u_k adj(u_k) acts on the coordinates k, ..., dim - 1.
+    This is the Householder-QR version of the construction from
+    http://arxiv.org/abs/math-ph/0609050: the k-th column of a Gaussian
+    matrix reduced by H_0, ..., H_{k-1} is again Gaussian, so the reflections
+    can be drawn independently from fresh Gaussian vectors. Storage and
+    application cost O(dim^2) instead of O(dim^3) for the dense QR.
+    """
+
+    def __init__(self, vectors, phases):
+        """
+        :param vectors: List of the normalized Householder vectors u_k of
+            length dim - k
+        :param phases: Diagonal of the phase matrix
+
+        """
+        self.vectors = vectors
+        self.phases = phases
+
+    @property
+    def dim(self):
+        return len(self.phases)
+
+    def apply_batch(self, V):
+        """Computes U * V.
+
+        :param V: Array of shape (dim, k)
+        :returns: Array of shape (dim, k)
+        """
+        W = self.phases[:, None] * V
+        for k in range(len(self.vectors) - 1, -1, -1):
+            u = self.vectors[k]
+            W[k:] -= 2 * np.outer(u, u.conj().dot(W[k:]))
+        return W
+
+    def apply(self, v):
+        """Computes U * v.
+
+        :param v: Vector of size dim
+        :returns: Vector of size dim
+        """
+        return self.apply_batch(np.asarray(v)[:, None])[:, 0]
+
+    def to_dense(self):
+        """Returns the dense (dim, dim) matrix U"""
+        return self.apply_batch(np.identity(self.dim, dtype=self.phases.dtype))
+
+
+def _householder(z, dim):
+    """Computes the Householder representation from the Gaussian random
+    numbers `z` of size dim * (dim + 1) / 2.
+    """
+    vectors = []
+    phases = np.empty(dim, dtype=z.dtype)
+    start = 0
+    for k in range(dim - 1):
+        x = z[start:start + dim - k]
+        start += dim - k
+        norm = np.linalg.norm(x)
+        theta = x[0] / np.abs(x[0]) if x[0] != 0 else 1
+        # H x = -theta * |x| e_0
+        u = x.copy()
+        u[0] += theta * norm
+        vectors.append(u / np.linalg.norm(u))
+        phases[k] = -theta
+    phases[dim - 1] = z[start] / np.abs(z[start])
+    return HouseholderUnitary(vectors, phases)
+
+
+def orthogonal_householder(dim, randn=np.random.randn, rng=None):
+    """Same as `orthogonal`, but returns a HouseholderUnitary, which can be
+    applied to vectors in O(dim^2) without computing the dense matrix.
+
+    :param int dim: Dimension
+    :param randn: Function to create real N(0,1) distributed random variables.
+        It should take the shape of the output as numpy.random.randn does
+        (default: numpy.random.randn)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
+    """
+    randn = _randn(randn, rng)
+    return _householder(randn(dim * (dim + 1) // 2), dim)
+
+
+def unitary_householder(dim, randn=np.random.randn, rng=None):
+    """Same as `unitary`, but returns a HouseholderUnitary, which can be
+    applied to vectors in O(dim^2) without computing the dense matrix.
+
+    :param int dim: Dimension
+    :param randn: Function to create real N(0,1) distributed random variables.
+        It should take the shape of the output as numpy.random.randn does
+        (default: numpy.random.randn)
+    :param rng: numpy.random.Generator to use instead of `randn`
+        (default: None)
+    """
+    randn = _randn(randn, rng)
+    size = dim * (dim + 1) // 2
+    z = (randn(size) + 1j * randn(size)) / np.sqrt(2.0)
+    return _householder(z, dim)
+
+
+##########################
+#  Spacing distributions  #
+##########################
+def _wigner_surmise(beta):
+    """Returns the Wigner surmise of the level spacing distribution for the
+    Dyson index `beta` (normalized to unit mean)."""
+    const = {1: (np.pi / 2, np.pi / 4),
+             2: (32 / np.pi**2, 4 / np.pi),
+             4: (2**18 / (3**6 * np.pi**3), 64 / (9 * np.pi))}
+    a, b = const[beta]
+    return lambda s: a * s**beta * np.exp(-b * s**2)
+
+
+LEVEL_SPACING_DF = {'orthogonal': _wigner_surmise(1),
+                    'unitary': _wigner_surmise(2),
+                    'circular_orthogonal': _wigner_surmise(1),
+                    'circular_unitary': _wigner_surmise(2),
+                    'circular_symplectic': _wigner_surmise(4),
                     }
 
+# Multiplicity of the eigenvalues of the ensembles
+_DEGENERACY = {'circular_symplectic': 2}
+
+
+def eigenphase_spacings(samples, degeneracy=1):
+    """Computes the nearest-neighbour spacings of the eigenphases of the
+    (stack of) unitary matrices `samples`, including the spacing across the
+    branch cut. The spacings are unfolded by the mean spacing
+    2 pi / (number of distinct eigenphases), so they have exactly unit mean.
+
+    :param samples: Array of shape (dim, dim) or (size, dim, dim)
+    :param int degeneracy: Multiplicity of the eigenvalues, e.g. 2 for the
+        circular symplectic ensemble (default 1)
+    :returns: Array of shape (dim / degeneracy,) or (size, dim / degeneracy)
+    """
+    phases = np.sort(np.angle(np.linalg.eigvals(samples)), axis=-1)
+    if degeneracy > 1:
+        # a degenerate multiplet may straddle the branch cut at +-pi, so
+        # start after the largest gap, which never splits a multiplet,
+        # before taking every `degeneracy`-th phase
+        dim = phases.shape[-1]
+        gaps = np.diff(phases, axis=-1, append=phases[..., :1] + 2 * np.pi)
+        start = (np.argmax(gaps, axis=-1) + 1)[..., None] % dim
+        idx = (start + np.arange(dim)) % dim
+        phases = np.take_along_axis(phases, idx, axis=-1) \
+            + 2 * np.pi * (idx < start)
+        phases = phases[..., ::degeneracy]
+    spacings = np.diff(phases, axis=-1,
+                       append=phases[..., :1] + 2 * np.pi)
+    return spacings * phases.shape[-1] / (2 * np.pi)
+
+
+class SpacingHistogram(object):
+
+    """Fixed-bin histogram with running moments, which accumulates level
+    spacings in constant memory. Histograms of independent runs can be merged.
+    """
+
+    def __init__(self, bins=50, smax=4.):
+        """
+        :param int bins: Number of bins (default 50)
+        :param float smax: Upper edge of the last bin; larger spacings are only
+            counted as overflow (default 4)
+
+        """
+        self.edges = np.linspace(0, smax, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.overflow = 0
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+
+    def update(self, spacings):
+        """Adds the `spacings` to the histogram and the running moments."""
+        spacings = np.ravel(spacings)
+        counts, _ = np.histogram(spacings, bins=self.edges)
+        self.counts += counts
+        self.overflow += len(spacings) - counts.sum()
+        if len(spacings) > 0:
+            self._add_moments(len(spacings), np.mean(spacings),
+                              np.sum((spacings - np.mean(spacings))**2))
+        return self
+
+    def merge(self, other):
+        """Adds the data of the histogram `other` (with identical bins)."""
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError("ccg_haar.py:merge: Bins do not match.")
+        self.counts += other.counts
+        self.overflow += other.overflow
+        if other.count > 0:
+            self._add_moments(other.count, other.mean, other._m2)
+        return self
+
+    def _add_moments(self, count, mean, m2):
+        # parallel variance algorithm of Chan et al.
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self._m2 += m2 + delta**2 * self.count * count / total
+        self.count = total
 
+    @property
+    def variance(self):
+        return self._m2 / self.count if self.count > 0 else np.nan
+
+    @property
+    def centers(self):
+        return (self.edges[1:] + self.edges[:-1]) / 2
+
+    def density(self):
+        """Returns the normalized density (including the overflow in the
+        normalization) at the bin centers."""
+        return self.counts / (self.count * np.diff(self.edges))
+
+    def distance(self, df):
+        """Returns the L1 distance between the histogram and the probability
+        density `df` (evaluated at the bin centers) on [0, smax]."""
+        return np.sum(np.abs(self.density() - df(self.centers))
+                      * np.diff(self.edges))
+
+
+def _spacing_chunk(size, rng, ensemble, dim, bins, smax):
+    """Computes the spacing histogram of `size` samples; executed in the
+    worker processes of `spacing_statistics`."""
+    samples = globals()[ensemble](dim, size=size, rng=rng)
+    spacings = eigenphase_spacings(samples, _DEGENERACY.get(ensemble, 1))
+    return SpacingHistogram(bins, smax).update(spacings)
+
+
+def spacing_statistics(ensemble, dim, samples, bins=50, smax=4., seed=None,
+                       chunksize=1000, processes=None):
+    """Computes the eigenphase spacing distribution of `samples` samples
+    from `ensemble`. The samples are drawn and diagonalized in chunks in a
+    process pool (see `sample_parallel`), and only the histograms of the
+    chunks are sent back and merged. Hence, the memory requirement is
+    independent of the number of samples.
+
+    :param str ensemble: Name of the sampler, e.g. 'unitary' or
+        'circular_symplectic'
+    :param int dim: Dimension
+    :param int samples: Number of samples
+    :param int bins: Number of bins of the histogram (default 50)
+    :param float smax: Upper edge of the histogram (default 4)
+    :param seed: Seed for numpy.random.SeedSequence (default: None)
+    :param int chunksize: Number of samples per chunk (default 1000)
+    :param int processes: Number of worker processes (default: None, i.e. the
+        number of CPUs)
+    :returns: SpacingHistogram
+    """
+    hist = SpacingHistogram(bins, smax)
+    for chunk in _map_chunks(_spacing_chunk, samples, chunksize, seed,
+                             processes, ensemble, dim, bins, smax):
+        hist.merge(chunk)
+    return hist
+
+
+#############
+#  Tesing   #
+#############
 def _test_ensemble(dim, ensemble, samples=1000):
-    import matplotlib
-    matplotlib.use('TkAgg')
     from matplotlib import pyplot as pl
-    from tools.helpers import Progress
-
-    eigdists = []
-    get_sample = globals()[ensemble]
-    for _ in Progress(xrange(samples)):
-        u = get_sample(dim)
-        eigs = np.sort(np.angle(eigvals(u)))
-        eigdists += list(eigs[1:] - eigs[:-1])
-
-    eigdists = np.asarray(eigdists) / (np.sum(eigdists) / len(eigdists))
-    pl.hist(eigdists, bins=50, normed=True)
-    dist = lambda s: 32 / np.pi**2 * s**2 * np.exp(-4 / np.pi * s**2)
-    s = np.linspace(0, 4, 100)
-    pl.plot(s, dist(s))
+
+    hist = spacing_statistics(ensemble, dim, samples)
+    print("{}: mean={}, variance={}, L1 distance to surmise={}"
+          .format(ensemble, hist.mean, hist.variance,
+                  hist.distance(LEVEL_SPACING_DF[ensemble])))
+    pl.bar(hist.centers, hist.density(), width=np.diff(hist.edges))
+    s = np.linspace(0, hist.edges[-1], 100)
+    pl.plot(s, LEVEL_SPACING_DF[ensemble](s))
     pl.show()
 
 if __name__ == '__main__':
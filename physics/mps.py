@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+"""Matrix product state (MPS) representation of states on chains of
+distinguishable sites.
+
+The MPS uses the same factor ordering as :func:`qstat.tensor`, i.e. site 0
+corresponds to the innermost index of the dense vector. Hence, the dense
+representation of `MPS.from_product(xs)` is `tensor(xs)` and the local
+operator `op` on site `pos` corresponds to `embed(op, pos, dims)`.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+
+
+def _truncated_svd(mat, max_bond=None, tol=0.):
+    """Computes the singular value decomposition mat = u * diag(s) * v and
+    discards all singular values beyond `max_bond` or below `tol` (relative
+    to the largest one).
+
+    :param mat: 2D array
+    :param max_bond: Maximal number of singular values to keep (default None:
+                     no limit)
+    :param tol: Relative cutoff for the singular values (default 0)
+    :returns: u, s, v
+
+    """
+    u, s, v = np.linalg.svd(mat, full_matrices=False)
+    rank = len(s)
+    if tol > 0 and rank > 0:
+        rank = max(1, int(np.sum(s > tol * s[0])))
+    if max_bond is not None:
+        rank = min(rank, max_bond)
+    return u[:, :rank], s[:rank], v[:rank]
+
+
+class MPS(object):
+
+    """Matrix product state
+
+        psi[i_0, ..., i_{n-1}] = A_0[i_0] * A_1[i_1] * ... * A_{n-1}[i_{n-1}]
+
+    where the site tensors A_j are stored as arrays of shape
+    (chi_j, d_j, chi_{j+1}) with chi_0 = chi_n = 1. The tensors are never
+    modified in place, so they may be shared between different instances.
+    """
+
+    def __init__(self, tensors):
+        """
+        :param tensors: List of site tensors of shape (chi_j, d_j, chi_{j+1})
+
+        """
+        self.tensors = [np.asarray(tensor) for tensor in tensors]
+
+    @classmethod
+    def from_product(cls, xs):
+        """Exact MPS representation (with bond dimension 1) of the product
+        state tensor(xs).
+
+        :param xs: List of vectors
+        :returns: MPS
+
+        """
+        return cls([np.reshape(x, (1, -1, 1)) for x in xs])
+
+    @classmethod
+    def from_vector(cls, psi, dims, max_bond=None, tol=0.):
+        """Computes the MPS representation of the dense vector `psi` by
+        successive singular value decompositions.
+
+        :param psi: Vector of size prod_j dims[j]
+        :param dims: List of the local dimensions
+        :param max_bond: Maximal bond dimension (default None: exact)
+        :param tol: Relative cutoff for the singular values (default 0)
+        :returns: MPS
+
+        """
+        dims = tuple(dims)
+        # bring site 0 to the outermost axis
+        rest = np.reshape(psi, dims[::-1]).transpose()
+        rest = rest.reshape((1, -1))
+        tensors = []
+        for dim in dims[:-1]:
+            chi = rest.shape[0]
+            u, s, v = _truncated_svd(rest.reshape((chi * dim, -1)), max_bond,
+                                     tol)
+            tensors.append(u.reshape((chi, dim, -1)))
+            rest = s[:, None] * v
+        tensors.append(rest.reshape((rest.shape[0], dims[-1], 1)))
+        return cls(tensors)
+
+    def __len__(self):
+        return len(self.tensors)
+
+    @property
+    def dims(self):
+        """List of the local dimensions"""
+        return [tensor.shape[1] for tensor in self.tensors]
+
+    @property
+    def bond_dims(self):
+        """List of the bond dimensions chi_1, ..., chi_{n-1}"""
+        return [tensor.shape[2] for tensor in self.tensors[:-1]]
+
+    def to_vector(self):
+        """Returns the dense vector representation (with the ordering of
+        :func:`qstat.tensor`). Note that this requires memory exponential in
+        the number of sites.
+
+        """
+        psi = np.ones((1, 1))
+        for tensor in self.tensors:
+            # psi[outer, chi] * A[chi, i, chi'] -> psi[i * outer, chi']
+            psi = np.tensordot(psi, tensor, axes=(1, 0))
+            psi = psi.transpose((1, 0, 2)).reshape((-1, tensor.shape[2]))
+        return psi.reshape(-1)
+
+    def apply_local(self, op, pos):
+        """Applies the operator `op` to site `pos`, which does not change the
+        bond dimensions.
+
+        :param op: d*d array
+        :param pos: Site index
+        :returns: New MPS
+
+        """
+        tensors = list(self.tensors)
+        tensors[pos] = np.einsum('ij,ajb->aib', op, tensors[pos])
+        return type(self)(tensors)
+
+    def compress(self, max_bond=None, tol=0.):
+        """Truncates the bond dimensions by bringing the MPS into
+        left-canonical form using QR decompositions and, subsequently,
+        discarding the smallest singular values in a sweep from the right.
+
+        :param max_bond: Maximal bond dimension (default None: no limit)
+        :param tol: Relative cutoff for the singular values (default 0)
+        :returns: New MPS
+
+        """
+        tensors = list(self.tensors)
+        for pos in range(len(tensors) - 1):
+            chi, dim, _ = tensors[pos].shape
+            q, r = np.linalg.qr(tensors[pos].reshape((chi * dim, -1)))
+            tensors[pos] = q.reshape((chi, dim, -1))
+            tensors[pos + 1] = np.tensordot(r, tensors[pos + 1], axes=(1, 0))
+
+        for pos in range(len(tensors) - 1, 0, -1):
+            _, dim, chi = tensors[pos].shape
+            u, s, v = _truncated_svd(tensors[pos].reshape((-1, dim * chi)),
+                                     max_bond, tol)
+            tensors[pos] = v.reshape((-1, dim, chi))
+            tensors[pos - 1] = np.tensordot(tensors[pos - 1], u * s,
+                                            axes=(2, 0))
+        return type(self)(tensors)
+
+    def overlap(self, other):
+        """Computes the scalar product <self|other>.
+
+        :param other: MPS with the same local dimensions
+        :returns: Complex number
+
+        """
+        if self.dims != other.dims:
+            raise IndexError("mps.py:overlap: Dimensions do not match.")
+
+        transfer = np.ones((1, 1))
+        for bra, ket in zip(self.tensors, other.tensors):
+            # transfer[a, b] * conj(bra)[a, i, c] * ket[b, i, d]
+            transfer = np.tensordot(transfer, bra.conj(), axes=(0, 0))
+            transfer = np.tensordot(transfer, ket, axes=([0, 1], [0, 1]))
+        return transfer[0, 0]
+
+    def norm(self):
+        """Returns the norm of the state"""
+        return np.sqrt(np.abs(self.overlap(self)))
+
+    def expectation(self, op, pos):
+        """Computes the expectation value <psi|op|psi> / <psi|psi> of the
+        operator `op` acting on site `pos`.
+
+        :param op: d*d array
+        :param pos: Site index
+        :returns: Complex number
+
+        """
+        return self.overlap(self.apply_local(op, pos)) / self.overlap(self)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""Compact representation of multi-qubit Pauli strings.
+
+A Pauli string on n qubits is stored as two bit masks x, z and a phase p as
+
+        P = i^p * X^x_0 Z^z_0 (x) X^x_1 Z^z_1 (x) ... (x) X^x_{n-1} Z^z_{n-1}
+
+where x_q, z_q denote the q-th bit of x, z. The qubits are ordered as in
+:func:`qstat.tensor`, i.e. qubit 0 is the innermost factor (the lowest bit of
+the basis index). The single-qubit matrices are those of :data:`qmech.PAULI`;
+note that qmech.SY = -i * SX * SZ.
+"""
+
+from __future__ import division, print_function
+import numpy as np
+
+from .qmech import PAULI
+from .qstat import _popcount, tensor
+
+# (x, z) bits of the entries of PAULI; all are given by X^x Z^z except for
+# PAULI[2] = SY = i^3 * X Z
+_FACTORS = ((0, 0), (1, 0), (1, 1), (0, 1))
+_LABELS = 'IXYZ'
+
+
+def _bitcount(value):
+    """Returns the number of set bits of the integer `value`"""
+    return bin(value).count('1')
+
+
+class PauliString(object):
+
+    """Pauli string i^phase * X^x Z^z on `nr_qubits` qubits (see module
+    docstring). Products and commutation relations are computed using bit
+    operations on the masks only.
+    """
+
+    def __init__(self, x, z, phase=0, nr_qubits=None):
+        """
+        :param x: Bit mask of the qubits with an X factor
+        :param z: Bit mask of the qubits with a Z factor
+        :param phase: Global phase i^phase (default 0)
+        :param nr_qubits: Number of qubits (default None: the smallest number
+                          compatible with `x` and `z`)
+
+        """
+        self.x = int(x)
+        self.z = int(z)
+        self.phase = int(phase) % 4
+        self.nr_qubits = max((self.x | self.z).bit_length(), 1) \
+            if nr_qubits is None else nr_qubits
+
+    @classmethod
+    def from_label(cls, label):
+        """Creates the Pauli string from a label such as 'XIZY', where the
+        q-th character (one of I, X, Y, Z) determines the factor acting on
+        qubit q (cf. qmech.PAULI).
+
+        :param label: String of length nr_qubits
+        :returns: PauliString
+
+        """
+        x, z = 0, 0
+        for qubit, char in enumerate(label.upper()):
+            if char not in _LABELS:
+                raise ValueError("pauli.py:from_label: Invalid label {}"
+                                 .format(label))
+            x_q, z_q = _FACTORS[_LABELS.index(char)]
+            x |= x_q << qubit
+            z |= z_q << qubit
+        return cls(x, z, 3 * _bitcount(x & z), nr_qubits=len(label))
+
+    def _factors(self):
+        """Returns the indices of the single-qubit factors in PAULI"""
+        return [_FACTORS.index(((self.x >> q) & 1, (self.z >> q) & 1))
+                for q in range(self.nr_qubits)]
+
+    def __repr__(self):
+        label = ''.join(_LABELS[n] for n in self._factors())
+        # correct for the phases of the Y factors contained in the label
+        phase = (self.phase - 3 * _bitcount(self.x & self.z)) % 4
+        return "{}{}".format(('', 'i', '-', '-i')[phase], label)
+
+    def __eq__(self, other):
+        return (self.x, self.z, self.phase, self.nr_qubits) \
+            == (other.x, other.z, other.phase, other.nr_qubits)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.x, self.z, self.phase, self.nr_qubits))
+
+    def __mul__(self, other):
+        # Z^z1 X^x2 = (-1)^|z1 & x2| X^x2 Z^z1
+        phase = self.phase + other.phase + 2 * _bitcount(self.z & other.x)
+        return type(self)(self.x ^ other.x, self.z ^ other.z, phase,
+                          max(self.nr_qubits, other.nr_qubits))
+
+    def commutes(self, other):
+        """Returns True if the two Pauli strings commute and False if they
+        anticommute.
+
+        """
+        return (_bitcount(self.x & other.z) + _bitcount(self.z & other.x)) \
+            % 2 == 0
+
+    def to_dense(self):
+        """Returns the dense 2^n * 2^n matrix representation (for testing
+        purposes).
+
+        """
+        phase = (self.phase - 3 * _bitcount(self.x & self.z)) % 4
+        return 1j**phase * tensor([PAULI[n] for n in self._factors()])
+
+    def apply(self, psi):
+        """Computes P * psi in O(2^n) using that X^x only permutes the basis
+        states (b -> b ^ x) and Z^z only changes their signs.
+
+        :param psi: Vector of size 2^n or array of shape (k, 2^n) containing k
+                    states as rows
+        :returns: Array of same shape as `psi`
+
+        """
+        perm = np.arange(2**self.nr_qubits, dtype=np.int64) ^ self.x
+        signs = 1 - 2 * (_popcount(perm & self.z) & 1).astype(np.int64)
+        return 1j**self.phase * signs * np.asarray(psi)[..., perm]
+
+
+def expectation_values(strings, psi, chunksize=2**22):
+    """Computes the expectation values <psi|P|psi> for many Pauli strings P
+    at once. The strings are grouped by their X mask, such that the
+    permutation of `psi` is only carried out once per group; the signs due
+    to the Z masks are then applied as a (sign matrix * vector) product.
+
+    :param strings: List of PauliStrings on n qubits
+    :param psi: Vector of size 2^n (assumed to be normalized)
+    :param chunksize: Maximal number of entries of the temporary sign matrix
+                      (default 2^22)
+    :returns: Complex array of size len(strings)
+
+    """
+    psi = np.asarray(psi)
+    indices = np.arange(len(psi), dtype=np.int64)
+    xs = np.array([string.x for string in strings], dtype=np.int64)
+    zs = np.array([string.z for string in strings], dtype=np.int64)
+    phases = 1j**np.array([string.phase for string in strings])
+    step = max(1, chunksize // max(1, len(psi)))
+
+    res = np.empty(len(strings), dtype=complex)
+    for x in np.unique(xs):
+        perm = indices ^ x
+        prod = psi.conj() * psi[perm]
+        group = np.flatnonzero(xs == x)
+        for start in range(0, len(group), step):
+            sel = group[start:start + step]
+            parity = _popcount(perm & zs[sel, None]) & 1
+            res[sel] = prod.sum() - 2 * parity.dot(prod)
+    return phases * res
@@ -25,6 +25,45 @@ def tensor(xs, kronfun=np.kron):
     return res
 
 
+def tensor_batch(xs, out=None):
+    """Batched version of :func:`tensor` for many product vectors at once.
+    The factor ordering is the same, i.e. `xs[:, 0]` is the innermost index.
+
+    The product is built up in place in `out`: after processing k sites, the
+    first d^k entries of each row contain the partial product, which is then
+    scaled into the d blocks of size d^k (starting from the last block, so
+    the partial product itself is overwritten last). No intermediate arrays
+    are allocated.
+
+    :param xs: Array of shape (batch, n_sites, d)
+    :param out: Preallocated output array of shape (batch, d^n_sites); its
+                dtype has to be able to hold the result (default None: a new
+                array is allocated)
+    :returns: Array of shape (batch, d^n_sites) with
+                out[b] == tensor(xs[b])
+
+    """
+    xs = np.asarray(xs)
+    batch, n_sites, dim = xs.shape
+    if out is None:
+        out = np.empty((batch, dim**n_sites), dtype=xs.dtype)
+    elif out.shape != (batch, dim**n_sites):
+        raise IndexError("qustat.py:tensor_batch: Output has wrong shape.")
+
+    if n_sites == 0:
+        out[:] = 1
+        return out
+
+    out[:, :dim] = xs[:, 0]
+    size = dim
+    for site in range(1, n_sites):
+        for i in range(dim - 1, -1, -1):
+            np.multiply(out[:, :size], xs[:, site, i, None],
+                        out=out[:, i * size:(i + 1) * size])
+        size *= dim
+    return out
+
+
 def embed(op, pos, full_space, kronfun=np.kron, identity=np.identity):
     """Returns the matrix representaion of the embeding
 
@@ -62,9 +101,159 @@ def embed(op, pos, full_space, kronfun=np.kron, identity=np.identity):
     return tensor(idmatrices[:pos] + [op] + idmatrices[pos + 1:], kronfun)
 
 
+def _full_space_dims(op, full_space):
+    """Returns the dimension list corresponding to `full_space` as described
+    in :func:`embed`.
+
+    :param op: n*n array; the operator to be embeded
+    :param full_space: list-like of dimensions or number of factor spaces
+    :returns: Tuple of dimensions of the factor spaces
+
+    """
+    if not hasattr(full_space, '__iter__'):
+        return (np.shape(op)[0],) * full_space
+    return tuple(full_space)
+
+
+def apply_embedded(op, pos, full_space, psi):
+    """Computes the action of the embeded operator `embed(op, pos,
+    full_space)` on `psi` without building the matrix. Instead, `psi` is
+    reshaped such that the `pos`-th factor space is a separate axis and `op`
+    is contracted along that axis.
+
+    :param op: n*n array or sparse matrix; the operator to be embeded
+    :param pos: integer; the factor space in which `op` is embeded
+    :param full_space: see :func:`embed`
+    :param psi: Either a vector of size D = prod_j full_space[j] or an array
+                of shape (k, D) containing k states as rows
+    :returns: Array of same shape as `psi`
+
+    """
+    dims = _full_space_dims(op, full_space)
+    if np.shape(op)[0] != dims[pos]:
+        raise IndexError("qustat.py:apply_embedded: Dimensions do not match.")
+
+    psi = np.asarray(psi)
+    # Since xs[0] is the innermost factor of `tensor`, the factor space `pos`
+    # corresponds to the axis between the (outer) sites pos+1... and the
+    # (inner) sites ...pos-1
+    outer = int(np.prod(dims[pos + 1:], dtype=int))
+    inner = int(np.prod(dims[:pos], dtype=int))
+    batch = psi.reshape((-1, outer, dims[pos], inner))
+
+    # move the contracted axis to the front such that `op` may be sparse
+    tmp = np.moveaxis(batch, 2, 0).reshape((dims[pos], -1))
+    res = np.asarray(op.dot(tmp))
+    res = np.moveaxis(res.reshape((dims[pos],) + batch.shape[:2] + (inner,)),
+                      0, 2)
+    return res.reshape(psi.shape)
+
+
+def embed_operator(op, pos, full_space):
+    """Matrix-free version of :func:`embed`. Returns a
+    scipy.sparse.linalg.LinearOperator, which applies `op` to the `pos`-th
+    factor space using :func:`apply_embedded`. Hence, only O(D) memory is
+    required instead of O(D^2) for the full matrix.
+
+    :param op: n*n array or sparse matrix; the operator to be embeded
+    :param pos: integer; the factor space in which `op` is embeded
+    :param full_space: see :func:`embed`
+    :returns: LinearOperator of shape (D, D) with D = prod_j full_space[j]
+
+    """
+    from scipy.sparse.linalg import LinearOperator
+
+    dims = _full_space_dims(op, full_space)
+    if np.shape(op)[0] != dims[pos]:
+        raise IndexError("qustat.py:embed_operator: Dimensions do not match.")
+
+    op_adj = op.conj().T
+    dim = int(np.prod(dims, dtype=int))
+    return LinearOperator(
+        (dim, dim), dtype=op.dtype,
+        matvec=lambda v: apply_embedded(op, pos, dims, np.ravel(v)),
+        matmat=lambda V: apply_embedded(op, pos, dims, V.T).T,
+        rmatvec=lambda v: apply_embedded(op_adj, pos, dims, np.ravel(v)),
+        rmatmat=lambda V: apply_embedded(op_adj, pos, dims, V.T).T)
+
+
+def reduced_density_matrix(psi, keep, dims):
+    """Computes the reduced density matrix of the pure state(s) `psi` on the
+    factor spaces `keep` by tracing out all other factor spaces. The state
+    is reshaped into a (kept x traced) matrix A, so that rho = A * adj(A)
+    without ever building the full density matrix.
+
+    :param psi: Either a vector of size D = prod_j dims[j] or an array of
+                shape (k, D) containing k states as rows
+    :param keep: List of factor spaces to keep; the factor spaces of the
+                 result are ordered as in `keep` (using the same ordering as
+                 :func:`tensor`, i.e. keep[0] is the innermost factor)
+    :param dims: either list-like; each entry gives the dimension of the
+                 respective factor space or integer; total number of factor
+                 spaces of identical dimension (cf. `full_space` in
+                 :func:`embed`)
+    :returns: Array of shape (d_keep, d_keep) or (k, d_keep, d_keep),
+              respectively, where d_keep = prod_j dims[keep[j]]
+
+    """
+    psi = np.asarray(psi)
+    if not hasattr(dims, '__iter__'):
+        dim = int(round(psi.shape[-1]**(1 / dims)))
+        dims = (dim,) * dims
+    dims = tuple(dims)
+    if int(np.prod(dims, dtype=int)) != psi.shape[-1]:
+        raise IndexError("qustat.py:reduced_density_matrix: Dimensions do "
+                         "not match.")
+
+    nr_factors = len(dims)
+    keep = list(keep)
+    traced = [pos for pos in range(nr_factors) if pos not in keep]
+    # axis 0 is the batch axis, factor `pos` is on axis nr_factors - pos
+    axes = [0] + [nr_factors - pos for pos in keep[::-1]] \
+        + [nr_factors - pos for pos in traced[::-1]]
+    dim_keep = int(np.prod([dims[pos] for pos in keep], dtype=int))
+
+    batch = psi.reshape((-1,) + dims[::-1]).transpose(axes)
+    batch = batch.reshape((batch.shape[0], dim_keep, -1))
+    rho = np.einsum('kij,klj->kil', batch, batch.conj())
+    return rho.reshape(psi.shape[:-1] + (dim_keep, dim_keep))
+
+
 ######################################
 #  Bosonic manybody quantum systems  #
 ######################################
+def _symmetrize(xs, sign):
+    """Computes the (anti-)symmetrized tensor product of `xs` by axis
+    transpositions of the single product tensor `tensor(xs)`. We use the
+    coset decomposition of the symmetric group
+
+            S_m = S_{m-1} + sum_{k<m} (k m) S_{m-1},
+
+    i.e. if the first m-1 factors are already (anti-)symmetrized, the first m
+    factors are (anti-)symmetrized by averaging over the transpositions (k m).
+    Hence, the runtime scales as n^2 * d^n instead of n! * d^n.
+
+    :param xs: Array-like of n vectors of identical size
+    :param sign: +1 for symmetrization, -1 for antisymmetrization
+    :returns: Vector of size len(xs[0])^n
+
+    """
+    xs = np.asarray(xs)
+    nr_factors, dim = xs.shape[0], xs.shape[1]
+    res = tensor(xs).reshape((dim,) * nr_factors)
+
+    for m in range(1, nr_factors):
+        terms = res.copy()
+        for k in range(m):
+            if sign > 0:
+                terms += np.swapaxes(res, k, m)
+            else:
+                terms -= np.swapaxes(res, k, m)
+        res = terms / (m + 1)
+
+    return res.ravel()
+
+
 def symmtensor(xs):
     """Compute vector representation of the symmetrized tensor product
 
@@ -75,38 +264,89 @@ def symmtensor(xs):
     :returns: Vector of size len(xs[0])^n
 
     """
-    permutations = _permute(range(len(xs)))
-    return sum([tensor(xs[list(sigma)]) for sigma, _ in permutations]) / \
-            len(permutations)
+    return _symmetrize(xs, 1)
 
 
 ########################################
 #  Fermionic manybody quantum systems  #
 ########################################
-def _permute(seq):
-    """Returns all permutations and the signature of these permutations
-    of the sequence `seq`.
+PERMUTATION_TABLE_MAX = 10
+_PERMUTATION_TABLES = {}
+
+
+def permutations(seq):
+    """Lazily generates all permutations of the sequence `seq` together with
+    their signature using the Steinhaus-Johnson-Trotter algorithm (with Even's
+    speedup). Consecutive permutations differ by a single transposition of
+    neighbouring elements, so the signature simply alternates. Only O(n)
+    memory is used.
 
     :param seq: Iteratable
-    :returns: List of permutations, corresponding signature
-
-    Taken from http://rosettacode.org/wiki/Permutations_by_swapping#Python
-    """
-    items = [[]]
-    for j in seq:
-        new_items = []
-        for i, item in enumerate(items):
-            if i % 2:
-                # step up
-                new_items += [item[:i] + [j] + item[i:]
-                              for i in range(len(item) + 1)]
-            else:
-                # step down
-                new_items += [item[:i] + [j] + item[i:]
-                              for i in range(len(item), -1, -1)]
-        items = new_items
+    :returns: Generator of (permutation as tuple, signature) in a
+              deterministic order starting with the identity
+
+    """
+    items = list(seq)
+    nr_items = len(items)
+    perm = list(range(nr_items))
+    # direction in which each element (indexed by value) is moving
+    direction = [-1] * nr_items
+    sign = 1
+    yield tuple(items[i] for i in perm), sign
+
+    while True:
+        # find the largest mobile element, i.e. one that points to a smaller
+        # neighbour
+        mobile, mobile_pos = -1, -1
+        for pos, val in enumerate(perm):
+            target = pos + direction[val]
+            if val > mobile and 0 <= target < nr_items and perm[target] < val:
+                mobile, mobile_pos = val, pos
+        if mobile < 0:
+            return
+
+        target = mobile_pos + direction[mobile]
+        perm[mobile_pos], perm[target] = perm[target], perm[mobile_pos]
+        sign = -sign
+        for val in range(mobile + 1, nr_items):
+            direction[val] = -direction[val]
+
+        yield tuple(items[i] for i in perm), sign
+
+
+def permutation_table(nr_items):
+    """Returns all permutations of range(nr_items) in the order of
+    :func:`permutations` as arrays. The tables are cached, so repeated calls
+    for small `nr_items` are free.
+
+    :param nr_items: Number of elements to permute; at most
+                     PERMUTATION_TABLE_MAX
+    :returns: Read-only int8 arrays of shape (nr_items!, nr_items)
+              containing the permutations and (nr_items!,) containing their
+              signatures
+
+    """
+    if nr_items > PERMUTATION_TABLE_MAX:
+        raise ValueError("qustat.py:permutation_table: Table for {} elements "
+                         "too large; use permutations() instead."
+                         .format(nr_items))
+
+    try:
+        return _PERMUTATION_TABLES[nr_items]
+    except KeyError:
+        pass
+
+    nr_perms = int(np.prod(np.arange(1, nr_items + 1)))
+    perms = np.empty((nr_perms, nr_items), dtype=np.int8)
+    signs = np.empty(nr_perms, dtype=np.int8)
+    for n, (perm, sign) in enumerate(permutations(range(nr_items))):
+        perms[n] = perm
+        signs[n] = sign
 
-    return {(tuple(item), -1 if i % 2 else 1) for i, item in enumerate(items)}
+    perms.setflags(write=False)
+    signs.setflags(write=False)
+    _PERMUTATION_TABLES[nr_items] = perms, signs
+    return perms, signs
 
 
 def wedgetensor(xs):
@@ -123,9 +363,10 @@ def wedgetensor(xs):
     :returns: Vector of size len(xs[0])^n
 
     """
-    permutations = _permute(range(len(xs)))
-    return sum([sign * tensor(xs[list(sigma)])
-                for sigma, sign in permutations]) / len(permutations)
+    return _symmetrize(xs, -1)
+
+
+_ANNHILATORS = {}
 
 
 def annhilation_operators(nr_fermions):
@@ -144,18 +385,327 @@ def annhilation_operators(nr_fermions):
                 d_j = eta * eta * ... * d * I * ... * I.
 
     Here, I = diag(1, 1); eta = diag(1, -1); and d = ((0, 1), (0, 0)).
+    Instead of carrying out the Kronecker products, the CSR arrays are
+    computed directly from the bit representation of the basis states. The
+    results are cached for each `nr_fermions`; hence, the arrays of the
+    returned matrices are read-only (use `.copy()` for in-place operations)
+    and :func:`clear_annhilation_cache` frees the memory.
 
     :param nr_fermions: Number of fermions to consider
     :returns: List of length N, where the n-th entry is the sparse matrix
               representation of d_n
 
     """
-    iden = sp.identity(2)
-    eta = sp.spdiags([[1, -1]], [0], 2, 2)
-    annh = sp.csr_matrix([[0, 1], [0, 0]])
-    res = [tensor([eta]*n + [annh] + [iden]*(nr_fermions-1-n), sp.kron).tocsr()
-           for n in range(nr_fermions)]
+    try:
+        return list(_ANNHILATORS[nr_fermions])
+    except KeyError:
+        pass
 
-    for A in res:
-        A.eliminate_zeros()
-    return res
+    states = np.arange(2**nr_fermions, dtype=np.int64)
+    res = [_annhilation_operator(states, n) for n in range(nr_fermions)]
+    for annh in res:
+        # rows have at most one entry, so no operation has to sort them
+        annh.has_canonical_format = True
+        for arr in (annh.data, annh.indices, annh.indptr):
+            arr.setflags(write=False)
+    _ANNHILATORS[nr_fermions] = res
+    return list(res)
+
+
+def clear_annhilation_cache():
+    """Removes the matrices cached by :func:`annhilation_operators`."""
+    _ANNHILATORS.clear()
+
+
+def _popcount(values):
+    """Returns the number of set bits of each entry of the integer array
+    `values`.
+
+    :param values: Array of non-negative integers (at most 64 bit)
+    :returns: Unsigned integer array of same shape as `values`
+
+    """
+    try:
+        return np.bitwise_count(values)
+    except AttributeError:
+        # numpy < 2.0
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        bits = np.unpackbits(values.view(np.uint8)).reshape(values.shape + (-1,))
+        return bits.sum(axis=-1, dtype=np.uint8)
+
+
+def _annhilation_operator(states, mode):
+    """Computes the CSR representation of d_`mode` from the basis `states`
+    (see :func:`annhilation_operators`) directly: the only nonzero element in
+    column b (with bit `mode` set) is in row b - 2^mode with the Jordan-Wigner
+    sign given by the parity of the occupation of the lower modes.
+
+    :param states: Array range(2**nr_fermions)
+    :param mode: Index of the annhilation operator
+    :returns: Sparse matrix in CSR format
+
+    """
+    bit = 1 << mode
+    empty = (states & bit) == 0
+    cols = states[empty] | bit
+    data = 1. - 2. * (_popcount(cols & (bit - 1)) & 1)
+    indptr = np.zeros(len(states) + 1, dtype=cols.dtype)
+    np.cumsum(empty, out=indptr[1:])
+    return sp.csr_matrix((data, cols, indptr), shape=(len(states),) * 2)
+
+
+def _apply_ladder(states, mode, create):
+    """Applies adj(d)_`mode` (if `create`) or d_`mode` to the basis states
+    given by their bit representation (n_1 is the lowest bit).
+
+    :param states: Integer array of basis states
+    :param mode: Index of the mode
+    :param create: Apply the creator if True, otherwise the annhilator
+    :returns: Resulting basis states, the corresponding Jordan-Wigner signs
+              and a boolean mask, which is False where the result vanishes
+
+    """
+    bit = 1 << mode
+    valid = (states & bit) == (0 if create else bit)
+    signs = 1 - 2 * (_popcount(states & (bit - 1)) & 1).astype(np.int64)
+    return states ^ bit, signs, valid
+
+
+#############################
+#  Particle-number sectors  #
+#############################
+_BINOMIALS = {}
+
+
+def binomials(size):
+    """Returns Pascal's triangle binom[n, k] = (n choose k) for
+    0 <= n, k <= size.
+
+    :param size: Maximal n
+    :returns: Read-only int64 array of shape (size + 1, size + 1) (cached)
+
+    """
+    try:
+        return _BINOMIALS[size]
+    except KeyError:
+        pass
+
+    binom = np.zeros((size + 1, size + 1), dtype=np.int64)
+    binom[:, 0] = 1
+    for n in range(1, size + 1):
+        binom[n, 1:] = binom[n - 1, 1:] + binom[n - 1, :-1]
+    binom.setflags(write=False)
+    _BINOMIALS[size] = binom
+    return binom
+
+
+def rank_combinations(combs, size):
+    """Rank of the strictly increasing rows of `combs` with entries in
+    range(size) in the combinatorial number system, i.e.
+
+            rank(c_1 < c_2 < ... < c_k) = sum_i (c_i choose i).
+
+    Hence, the combinations of length k are numbered 0, ..., (size choose k)
+    - 1 in colexicographic order.
+
+    :param combs: Integer array of shape (..., k)
+    :param size: Upper bound for the entries of `combs`
+    :returns: int64 array of shape combs.shape[:-1]
+
+    """
+    binom = binomials(size)
+    combs = np.asarray(combs)
+    ranks = np.zeros(combs.shape[:-1], dtype=np.int64)
+    for i in range(combs.shape[-1]):
+        ranks += binom[combs[..., i], i + 1]
+    return ranks
+
+
+def unrank_combinations(ranks, length, size):
+    """Inverse of :func:`rank_combinations`.
+
+    :param ranks: Integer array of ranks
+    :param length: Length k of the combinations
+    :param size: Upper bound for the entries of the combinations
+    :returns: int64 array of shape ranks.shape + (length,)
+
+    """
+    binom = binomials(size)
+    ranks = np.array(ranks, dtype=np.int64)
+    combs = np.empty(ranks.shape + (length,), dtype=np.int64)
+    for i in range(length, 0, -1):
+        # largest c with (c choose i) <= rank; binom[:size, i] is sorted
+        combs[..., i - 1] = np.searchsorted(binom[:size, i], ranks,
+                                            side='right') - 1
+        ranks -= binom[combs[..., i - 1], i]
+    return combs
+
+
+def sector_dim(nr_fermions, nr_particles):
+    """Returns the dimension (N choose k) of the fixed particle-number sector.
+
+    :param nr_fermions: Number N of fermionic modes
+    :param nr_particles: Number k of particles
+    :returns: Dimension of the sector
+
+    """
+    return int(binomials(nr_fermions)[nr_fermions, nr_particles])
+
+
+def sector_rank(states, nr_fermions):
+    """Computes the index of the basis `states` (in bit representation, see
+    :func:`annhilation_operators`) in the basis of their particle-number
+    sector. The rank is given by the combinatorial number system, which
+    enumerates states with fixed particle number in ascending order of their
+    index in the full Fock space.
+
+    :param states: Integer array of basis states
+    :param nr_fermions: Number of fermionic modes
+    :returns: Integer array of same shape as `states`
+
+    """
+    binom = binomials(nr_fermions)
+    states = np.asarray(states, dtype=np.int64)
+    ranks = np.zeros(states.shape, dtype=np.int64)
+    count = np.zeros(states.shape, dtype=np.int64)
+    for mode in range(nr_fermions):
+        occupied = ((states >> mode) & 1).astype(bool)
+        count += occupied
+        ranks += np.where(occupied, binom[mode, count], 0)
+    return ranks
+
+
+def sector_unrank(ranks, nr_fermions, nr_particles):
+    """Inverse of :func:`sector_rank`.
+
+    :param ranks: Integer array of indices in the sector basis
+    :param nr_fermions: Number of fermionic modes
+    :param nr_particles: Number of particles
+    :returns: Integer array of basis states in bit representation
+
+    """
+    combs = unrank_combinations(ranks, nr_particles, nr_fermions)
+    return np.sum(np.left_shift(1, combs), axis=-1, dtype=np.int64)
+
+
+def sector_basis(nr_fermions, nr_particles):
+    """Returns the basis states |n_1,...,n_N> (in bit representation, see
+    :func:`annhilation_operators`) with fixed particle number
+    sum_j n_j = `nr_particles` in ascending order. Hence, the sector
+    representation of an operator A is given by the restriction
+    A[basis][:, basis] of its full Fock-space representation.
+
+    :param nr_fermions: Number N of fermionic modes
+    :param nr_particles: Number k of particles
+    :returns: Integer array of size (N choose k)
+
+    """
+    dim = sector_dim(nr_fermions, nr_particles)
+    return sector_unrank(np.arange(dim), nr_fermions, nr_particles)
+
+
+def hopping_operator(i, j, nr_fermions, nr_particles):
+    """Computes the sparse-matrix representation of the hopping term
+    adj(d)_i d_j restricted to the sector with `nr_particles` particles
+    w.r.t. the basis from :func:`sector_basis`.
+
+    :param i: Index of the creator
+    :param j: Index of the annhilator
+    :param nr_fermions: Number N of fermionic modes
+    :param nr_particles: Number k of particles
+    :returns: Sparse matrix in CSR format of size (N choose k)^2
+
+    """
+    basis = sector_basis(nr_fermions, nr_particles)
+    states, signs, valid = _apply_ladder(basis, j, create=False)
+    states, signs_i, valid_i = _apply_ladder(states, i, create=True)
+    valid &= valid_i
+    cols = np.flatnonzero(valid)
+    rows = sector_rank(states[valid], nr_fermions)
+    data = (signs * signs_i)[valid].astype(float)
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(basis),) * 2)
+
+
+###################################
+#  Second-quantized Hamiltonians  #
+###################################
+def _ladder_terms(coeffs, daggers, basis, nr_fermions, sector, chunksize):
+    """Computes the COO triplets of sum_{i_1...i_L} coeffs[i_1,...,i_L]
+    * D_1 ... D_L, where D_l = adj(d)_{i_l} if daggers[l] else d_{i_l}. All
+    terms of a chunk are applied to all basis states at once using bit
+    operations.
+
+    :param coeffs: Array with L axes of length `nr_fermions`
+    :param daggers: List of L booleans
+    :param basis: Integer array of basis states (see :func:`_apply_ladder`)
+    :param nr_fermions: Number of fermionic modes
+    :param sector: Whether `basis` is a particle-number sector basis
+    :param chunksize: Maximal number of (term, state) pairs per pass
+    :returns: rows, cols, data
+
+    """
+    terms = np.argwhere(coeffs != 0)
+    values = coeffs[tuple(terms.T)]
+    step = max(1, chunksize // max(1, len(basis)))
+    empty = np.zeros(0, dtype=np.int64)
+    rows, cols, data = [empty], [empty], [values[:0]]
+
+    for start in range(0, len(terms), step):
+        modes = terms[start:start + step]
+        states = np.broadcast_to(basis, (len(modes), len(basis)))
+        signs = np.ones(states.shape, dtype=np.int64)
+        valid = np.ones(states.shape, dtype=bool)
+        for pos in range(len(daggers) - 1, -1, -1):
+            states, sign, nonzero = _apply_ladder(states, modes[:, pos, None],
+                                                  daggers[pos])
+            signs *= sign
+            valid &= nonzero
+
+        term_idx, cols_ = np.nonzero(valid)
+        rows.append(sector_rank(states[valid], nr_fermions) if sector
+                    else states[valid])
+        cols.append(cols_)
+        data.append(values[start + term_idx] * signs[valid])
+
+    return rows, cols, data
+
+
+def hamiltonian(hopping, interaction=None, nr_particles=None,
+                chunksize=2**22):
+    """Computes the sparse-matrix representation of the Hamiltonian
+
+        H = sum_ij h_ij adj(d)_i d_j
+                + sum_ijkl V_ijkl adj(d)_i adj(d)_j d_k d_l
+
+    in the basis of :func:`annhilation_operators` (or in the sector basis of
+    :func:`sector_basis` if `nr_particles` is given). Instead of multiplying
+    the sparse matrices of the ladder operators, the matrix elements are
+    computed directly from the bit representations of the basis states.
+
+    :param hopping: Array h of shape (N, N)
+    :param interaction: Array V of shape (N, N, N, N) (default None)
+    :param nr_particles: Restrict H to the sector with `nr_particles`
+                         particles (default None: full Fock space)
+    :param chunksize: Maximal number of (term, basis state) pairs processed
+                      at once; bounds the temporary memory (default 2^22)
+    :returns: Sparse matrix in CSR format
+
+    """
+    hopping = np.asarray(hopping)
+    nr_fermions = hopping.shape[0]
+    sector = nr_particles is not None
+    basis = sector_basis(nr_fermions, nr_particles) if sector \
+        else np.arange(2**nr_fermions, dtype=np.int64)
+
+    rows, cols, data = _ladder_terms(hopping, [True, False], basis,
+                                     nr_fermions, sector, chunksize)
+    if interaction is not None:
+        res = _ladder_terms(np.asarray(interaction), [True, True, False, False],
+                            basis, nr_fermions, sector, chunksize)
+        rows, cols, data = rows + res[0], cols + res[1], data + res[2]
+
+    dtype = np.result_type(hopping, float) if interaction is None \
+        else np.result_type(hopping, interaction, float)
+    return sp.coo_matrix((np.concatenate(data).astype(dtype),
+                          (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(len(basis),) * 2).tocsr()
@@ -0,0 +1,9 @@
+"""Pooled functions imported by test_decorators only after the pool exists"""
+import os
+
+from tools.decorators import processify
+
+
+@processify(pool=True, processes=2)
+def _pool_pid(delay=0):
+    return 'late', os.getpid()
@@ -0,0 +1,50 @@
+import pytest
+import numpy as np
+from itertools import product
+from math import factorial
+
+import physics.bosons as bs
+import physics.qstat as qs
+
+
+@pytest.mark.parametrize("nr_modes, nr_bosons", list(product(range(1, 5), range(0, 5))))
+def test_occupation_basis(nr_modes, nr_bosons):
+    basis = bs.occupation_basis(nr_modes, nr_bosons)
+    dim = factorial(nr_bosons + nr_modes - 1) \
+        // factorial(nr_bosons) // factorial(nr_modes - 1)
+
+    assert basis.shape == (dim, nr_modes)
+    assert (basis.sum(axis=1) == nr_bosons).all()
+    assert len(set(map(tuple, basis))) == dim
+    assert (bs.occupation_rank(basis) == np.arange(dim)).all()
+
+
+@pytest.mark.parametrize("nr_modes", range(1, 4))
+def test_annhilators(nr_modes):
+    max_bosons = 4
+    annh = bs.annhilation_operators(nr_modes, max_bosons)
+    # commutation relations only hold below the truncation
+    below = bs.basis_dim(nr_modes + 1, max_bosons - 1)
+
+    for i, j in product(range(nr_modes), range(nr_modes)):
+        comm = (annh[i] * annh[j].T - annh[j].T * annh[i]).toarray()
+        expected = np.identity(below) if i == j else 0
+        assert np.allclose(comm[:below, :below], expected)
+        assert np.allclose((annh[i] * annh[j] - annh[j] * annh[i]).toarray(), 0)
+
+
+@pytest.mark.parametrize("nr_modes, nr_bosons", list(product(range(1, 4), range(1, 4))))
+def test_tensor_conversion(nr_modes, nr_bosons):
+    basis = bs.occupation_basis(nr_modes, nr_bosons)
+    states = bs.to_tensor(np.identity(len(basis)), nr_modes, nr_bosons)
+    modes = np.identity(nr_modes)
+
+    for occupation, state in zip(basis, states):
+        occupied = np.repeat(np.arange(nr_modes), occupation)
+        symm = qs.symmtensor(modes[occupied])
+        assert np.allclose(state, symm / np.linalg.norm(symm))
+
+    coeffs = np.random.randn(len(basis)) + 1j * np.random.randn(len(basis))
+    psi = bs.to_tensor(coeffs, nr_modes, nr_bosons)
+    assert np.allclose(bs.from_tensor(psi, nr_modes, nr_bosons), coeffs)
+    assert np.allclose(np.linalg.norm(psi), np.linalg.norm(coeffs))
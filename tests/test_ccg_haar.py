@@ -0,0 +1,157 @@
+import pytest
+import numpy as np
+
+import physics.ccg_haar as haar
+
+
+def _is_unitary(u):
+    iden = np.identity(u.shape[-1])
+    return np.allclose(np.einsum('...ji,...jk->...ik', u.conj(), u), iden)
+
+
+@pytest.mark.parametrize("sampler", [haar.orthogonal, haar.unitary])
+@pytest.mark.parametrize("dim", [1, 2, 5])
+def test_batched(sampler, dim):
+    single = sampler(dim)
+    assert single.shape == (dim, dim) and _is_unitary(single)
+
+    batch = sampler(dim, size=7)
+    assert batch.shape == (7, dim, dim) and _is_unitary(batch)
+
+    # the batched and the single-sample code path agree on the same input
+    z = np.random.randn(3, dim, dim)
+    for n, u in enumerate(sampler(dim, randn=lambda *s: z.reshape(s), size=3)):
+        assert np.allclose(u, sampler(dim, randn=lambda *s: z[n]))
+
+    chunks = list(haar.sample_chunks(sampler, dim, 25, chunksize=10))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+
+
+def test_unitary_moments():
+    # E|u_ij|^2 = 1/dim for Haar-random unitaries
+    u = haar.unitary(4, size=5000)
+    assert np.allclose(np.mean(np.abs(u)**2, axis=0), 1 / 4, atol=.02)
+
+
+@pytest.mark.parametrize("sampler", [haar.orthogonal_householder,
+                                     haar.unitary_householder])
+@pytest.mark.parametrize("dim", [1, 2, 5, 30])
+def test_householder(sampler, dim):
+    u = sampler(dim)
+    dense = u.to_dense()
+    assert dense.shape == (dim, dim) and _is_unitary(dense)
+
+    V = np.random.randn(dim, 4) + 1j * np.random.randn(dim, 4)
+    assert np.allclose(u.apply_batch(V), dense.dot(V))
+    assert np.allclose(u.apply(V[:, 0]), dense.dot(V[:, 0]))
+
+
+def test_householder_moments():
+    # the distribution of the entries has to agree with the QR construction
+    samples = [haar.unitary_householder(3).to_dense() for _ in range(5000)]
+    assert np.allclose(np.mean(np.abs(samples)**2, axis=0), 1 / 3, atol=.02)
+    assert np.allclose(np.mean(np.abs(samples)**4, axis=0), 2 / 12, atol=.02)
+    # E|tr U|^2 = 1 is sensitive to wrong phase corrections
+    traces = np.trace(samples, axis1=1, axis2=2)
+    assert np.allclose(np.mean(np.abs(traces)**2), 1, atol=.1)
+
+
+@pytest.mark.parametrize("sampler", [haar.orthogonal, haar.unitary,
+                                     haar.symplectic, haar.circular_orthogonal,
+                                     haar.circular_unitary,
+                                     haar.circular_symplectic])
+def test_rng(sampler):
+    dim = 4
+    samples = sampler(dim, size=3, rng=np.random.default_rng(42))
+    assert samples.shape == (3, dim, dim) and _is_unitary(samples)
+    assert _is_unitary(sampler(dim, rng=np.random.default_rng(1)))
+    assert np.array_equal(samples,
+                          sampler(dim, size=3, rng=np.random.default_rng(42)))
+
+    rngs = haar.spawn_rngs(42, 2)
+    assert not np.allclose(sampler(dim, rng=rngs[0]), sampler(dim, rng=rngs[1]))
+
+
+@pytest.mark.parametrize("sampler", [haar.orthogonal_householder,
+                                     haar.unitary_householder])
+def test_rng_householder(sampler):
+    first = sampler(5, rng=np.random.default_rng(42)).to_dense()
+    assert np.array_equal(first, sampler(5, rng=np.random.default_rng(42)).to_dense())
+
+
+def test_symplectic():
+    dim = 6
+    J = haar._symplectic_form(dim)
+    for S in haar.symplectic(dim, size=10):
+        assert np.allclose(S.T.dot(J).dot(S), J)
+
+    # the CSE matrices are self-dual with doubly degenerate eigenvalues
+    for W in haar.circular_symplectic(dim, size=10):
+        assert np.allclose(J.T.dot(W.T).dot(J), W)
+        phases = np.sort(np.angle(np.linalg.eigvals(W)))
+        assert np.allclose(phases[::2], phases[1::2], atol=1e-6)
+
+    with pytest.raises(ValueError):
+        haar.symplectic(3)
+
+
+def test_sample_parallel():
+    chunks = list(haar.sample_parallel(haar.unitary, 3, 25, seed=1,
+                                       chunksize=10, processes=1))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+
+    for processes in (2, 3):
+        other = haar.sample_parallel(haar.unitary, 3, 25, seed=1, chunksize=10,
+                                     processes=processes)
+        for chunk, chunk_other in zip(chunks, other):
+            assert np.array_equal(chunk, chunk_other)
+
+
+def test_spacing_histogram():
+    data = np.random.rand(1000) * 5
+    hist = haar.SpacingHistogram(bins=10, smax=4.)
+    hist.update(data[:300]).update(data[300:600])
+    other = haar.SpacingHistogram(bins=10, smax=4.).update(data[600:])
+    hist.merge(other)
+
+    assert hist.count == 1000
+    assert hist.overflow == np.sum(data >= 4)
+    assert np.allclose(hist.mean, np.mean(data))
+    assert np.allclose(hist.variance, np.var(data))
+    assert (hist.counts == np.histogram(data, bins=hist.edges)[0]).all()
+
+
+def test_eigenphase_spacings():
+    # degenerate pair at the branch cut, i.e. one phase just below pi and
+    # one just above -pi
+    eps = 1e-9
+    phases = np.array([np.pi - eps, -np.pi + eps, .5, .5, -1, -1])
+    u = haar.unitary(6, rng=np.random.RandomState(4))
+    W = u.dot(np.diag(np.exp(1.j * phases))).dot(u.conj().T)
+    expected = np.array([1.5, np.pi - .5, np.pi - 1]) * 3 / (2 * np.pi)
+
+    spacings = haar.eigenphase_spacings(W, degeneracy=2)
+    assert np.allclose(np.sort(spacings), np.sort(expected), atol=1e-6)
+    spacings = haar.eigenphase_spacings(np.array([W, W.conj()]),
+                                        degeneracy=2)
+    assert spacings.shape == (2, 3)
+    assert np.allclose(np.sort(spacings, axis=-1), np.sort(expected),
+                       atol=1e-6)
+
+    spacings = haar.eigenphase_spacings(np.diag(np.exp(1.j * phases)))
+    assert np.allclose(np.sum(spacings), 6)
+
+
+@pytest.mark.parametrize("ensemble", ['circular_orthogonal', 'circular_unitary',
+                                      'circular_symplectic'])
+def test_spacing_statistics(ensemble):
+    hist = haar.spacing_statistics(ensemble, 20, 400, seed=3, chunksize=100,
+                                   processes=2)
+    dim = 10 if ensemble == 'circular_symplectic' else 20
+    assert hist.count == 400 * dim
+    assert np.allclose(hist.mean, 1)
+    assert hist.distance(haar.LEVEL_SPACING_DF[ensemble]) < .1
+
+    other = haar.spacing_statistics(ensemble, 20, 400, seed=3, chunksize=100,
+                                    processes=1)
+    assert (hist.counts == other.counts).all()
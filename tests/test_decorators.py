@@ -0,0 +1,603 @@
+import hashlib
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import Process
+
+import numpy as np
+import scipy.sparse as sp
+import pytest
+
+import tools.decorators as decorators
+from tools.decorators import cached_filefunc, memoize, processify
+
+
+@processify
+def _pid():
+    return os.getpid()
+
+
+@processify
+def _fail(msg):
+    raise ValueError(msg)
+
+
+@processify(pool=True, processes=2, maxtasksperchild=2)
+def _pool_pid(delay=0):
+    time.sleep(delay)
+    return os.getpid()
+
+
+@processify(pool=True, processes=2)
+def _pool_fail(msg):
+    raise ValueError(msg)
+
+
+def test_processify():
+    assert _pid() != os.getpid()
+
+    with pytest.raises(ValueError) as excinfo:
+        _fail('Oops')
+    assert 'Oops (in subprocess)' in str(excinfo.value)
+    assert '_fail' in str(excinfo.value)
+
+
+@processify(pool=True, processes=2)
+def _pool_interval(delay):
+    start = time.time()
+    time.sleep(delay)
+    return os.getpid(), start, time.time()
+
+
+def test_processify_pool():
+    # both calls run in parallel, i.e. their runtimes in the workers overlap
+    futures = [_pool_interval(.2) for _ in range(2)]
+    (pid1, start1, end1), (pid2, start2, end2) = \
+        [future.result(timeout=10) for future in futures]
+    assert pid1 != pid2 and os.getpid() not in (pid1, pid2)
+    assert max(start1, start2) < min(end1, end2)
+
+    # workers are recycled after two tasks each
+    pids = [_pool_pid().result(timeout=10) for _ in range(8)]
+    assert os.getpid() not in pids
+    assert len(set(pids)) > 2
+
+    with pytest.raises(ValueError) as excinfo:
+        _pool_fail('Oops').result()
+    assert 'Oops (in subprocess)' in str(excinfo.value)
+
+
+def test_processify_pool_late_import():
+    # the workers of the pool exist before the module is imported and the
+    # function has the same name as one in this module
+    _pool_fail('').exception(timeout=10)
+    assert '_late_pooled' not in sys.modules
+    import _late_pooled
+
+    late, pid = _late_pooled._pool_pid().result(timeout=10)
+    assert late == 'late' and pid != os.getpid()
+    assert isinstance(_pool_pid().result(timeout=10), int)
+
+
+@processify(pool=True, processes=1)
+def _pool_crash():
+    os._exit(1)
+
+
+def test_processify_pool_crash():
+    with pytest.raises(BrokenProcessPool):
+        _pool_crash().result(timeout=10)
+    # a new pool is created for the next call
+    with pytest.raises(BrokenProcessPool):
+        _pool_crash().result(timeout=10)
+
+
+@processify
+def _scale(arr, factor=2):
+    return {'scaled': arr * factor, 'small': np.arange(3), 'shape': arr.shape}
+
+
+@processify(pool=True, processes=2)
+def _pool_scale(arr, factor=2):
+    return arr * factor, arr.sum()
+
+
+@processify(pool=True, processes=2)
+def _pool_fail_shared(arr):
+    raise ValueError(arr.shape)
+
+
+def _segments():
+    return set(os.listdir('/dev/shm')) if os.path.isdir('/dev/shm') else set()
+
+
+def test_processify_shared_memory(monkeypatch):
+    monkeypatch.setattr(decorators, 'SHM_THRESHOLD', 1024)
+    before = _segments()
+    arr = np.random.randn(100, 100)
+
+    res = _scale(arr, factor=3)
+    assert np.allclose(res['scaled'], 3 * arr)
+    assert (res['small'] == np.arange(3)).all()
+    assert res['shape'] == arr.shape
+
+    scaled, total = _pool_scale(arr).result()
+    assert np.allclose(scaled, 2 * arr)
+    assert np.allclose(total, arr.sum())
+    # the result is backed by the (unlinked) segment and stays valid
+    view = scaled[::2]
+    del scaled
+    assert np.allclose(view, 2 * arr[::2])
+
+    with pytest.raises(ValueError):
+        _pool_fail_shared(arr).result()
+    assert _segments() == before
+
+
+@processify(pool=True, processes=2)
+def _pool_head(arr):
+    return arr[:10]
+
+
+def test_processify_shared_memory_views(monkeypatch):
+    monkeypatch.setattr(decorators, 'SHM_THRESHOLD', 1024)
+    before = _segments()
+    arr = np.random.randn(10**5)
+
+    # small views of the arguments outlive the call
+    assert (_pool_head(arr).result(timeout=10) == arr[:10]).all()
+    segments = []
+    ret, error = decorators._call_shared(lambda a: a[:10],
+                                         *decorators._share(((arr,), {}),
+                                                            segments))
+    decorators._release(segments, unlink=True)
+    assert error is None and (ret == arr[:10]).all()
+    assert _segments() == before
+
+
+@processify(pool=True, processes=2)
+def _pool_masked(arr):
+    return arr.sum(), arr[:10]
+
+
+def test_processify_shared_memory_subclass(monkeypatch):
+    monkeypatch.setattr(decorators, 'SHM_THRESHOLD', 1024)
+    arr = np.ma.masked_array(np.arange(10000.), mask=np.arange(10000) < 5000)
+
+    total, head = _pool_masked(arr).result()
+    assert total == arr.sum()
+    assert isinstance(head, np.ma.MaskedArray) and head.mask.all()
+
+
+_CALLS = []
+
+
+@cached_filefunc
+def _load(filename, scale=1):
+    _CALLS.append(filename)
+    with open(filename) as infile:
+        return scale * len(infile.read())
+
+
+@pytest.fixture
+def cachedir(tmp_path, monkeypatch):
+    monkeypatch.setattr(decorators, 'CACHEDIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(decorators, '_FINGERPRINTS', {})
+    monkeypatch.setattr(decorators, '_FINGERPRINT_UPDATES', {})
+    monkeypatch.setattr(decorators, '_FINGERPRINT_SAVES', {})
+    decorators.clear_memory_cache()
+    del _CALLS[:]
+    return tmp_path
+
+
+def _write(path, content, age=10):
+    path.write_text(content)
+    mtime = time.time() - age
+    os.utime(str(path), (mtime, mtime))
+
+
+def test_cached_filefunc(cachedir, monkeypatch):
+    # this file's source may have been modified recently
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+    assert _load(str(datafile)) == 3
+    assert _load(str(datafile)) == 3
+    assert _load(str(datafile), 2) == 6
+    assert len(_CALLS) == 2
+
+    # cache hits do not read the files again, even in a fresh process
+    hashed = []
+    original_hash = decorators._hash_file
+    monkeypatch.setattr(decorators, '_hash_file',
+                        lambda fn: hashed.append(fn) or original_hash(fn))
+    # as at exit of the process
+    decorators._flush_fingerprint_indices()
+    monkeypatch.setattr(decorators, '_FINGERPRINTS', {})
+    assert _load(str(datafile)) == 3
+    assert hashed == [] and len(_CALLS) == 2
+
+    _write(datafile, 'abcd')
+    assert _load(str(datafile)) == 4
+    assert hashed == [os.path.abspath(str(datafile))] and len(_CALLS) == 3
+
+    # recently modified files are always hashed since their mtime may not
+    # change on the next modification
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', 2 * 10**9)
+    _write(datafile, 'abcde', age=0)
+    assert _load(str(datafile)) == 5
+    assert _load(str(datafile)) == 5
+    assert hashed.count(os.path.abspath(str(datafile))) == 3
+    assert len(_CALLS) == 4
+
+
+@cached_filefunc(storage='numpy')
+def _load_arrays(filename, size=1000):
+    _CALLS.append(filename)
+    return {'data': np.arange(size), 'meta': ('text', [np.ones((2, 2)), 3])}
+
+
+@cached_filefunc(storage='numpy', compress=True)
+def _load_compressed(filename):
+    _CALLS.append(filename)
+    return np.zeros(1000)
+
+
+def test_cached_filefunc_numpy(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    for _ in range(2):
+        val = _load_arrays(str(datafile))
+        assert (val['data'] == np.arange(1000)).all()
+        assert val['meta'][0] == 'text' and val['meta'][1][1] == 3
+        assert (val['meta'][1][0] == np.ones((2, 2))).all()
+    assert len(_CALLS) == 1
+    # cached arrays are memory mapped read-only
+    assert isinstance(val['data'], np.memmap)
+    assert not val['data'].flags.writeable
+
+    for _ in range(2):
+        val = _load_compressed(str(datafile))
+        assert (val == 0).all() and val.shape == (1000,)
+    assert len(_CALLS) == 2
+    assert not isinstance(val, np.memmap)
+
+
+@cached_filefunc(storage='numpy')
+def _load_masked(filename):
+    _CALLS.append(filename)
+    return np.ma.masked_array(np.arange(5), mask=[0, 1, 0, 1, 0]), np.ones(3)
+
+
+def test_cached_filefunc_numpy_subclass(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    for _ in range(2):
+        decorators.clear_memory_cache()
+        masked, ones = _load_masked(str(datafile))
+        assert isinstance(masked, np.ma.MaskedArray)
+        assert masked.sum() == 6 and (ones == 1).all()
+    assert len(_CALLS) == 1
+    assert isinstance(ones, np.memmap)
+
+
+@cached_filefunc
+def _load_block(filename, size):
+    _CALLS.append(size)
+    return np.zeros(size, dtype=np.uint8)
+
+
+def test_cached_filefunc_memory_tier(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    monkeypatch.setattr(decorators, 'CACHE_MEMORY_BUDGET', 25000)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    val = _load_block(str(datafile), 10000)
+    assert _load_block(str(datafile), 10000) is val
+    stats = decorators.cache_stats()
+    assert stats['misses'] == 1 and stats['memory_hits'] == 1
+
+    # the second block evicts the first one from memory, but not from disk
+    _load_block(str(datafile), 20000)
+    assert decorators.cache_stats()['memory_evictions'] == 1
+    assert _load_block(str(datafile), 10000) is not val
+    assert decorators.cache_stats()['disk_hits'] == 1
+    assert _CALLS == [10000, 20000]
+
+    # unlimited budget
+    monkeypatch.setattr(decorators, 'CACHE_MEMORY_BUDGET', None)
+    val = _load_block(str(datafile), 30000)
+    assert _load_block(str(datafile), 30000) is val
+    assert _load_block(str(datafile), 20000) is _load_block(str(datafile),
+                                                            20000)
+
+
+@cached_filefunc
+def _load_structure(filename, size):
+    _CALLS.append(size)
+    return [np.zeros(size), sp.identity(size, format='csr')]
+
+
+def test_cached_filefunc_memory_tier_values(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    monkeypatch.setattr(decorators, 'CACHE_MEMORY_ENTRIES', 2)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    # arrays are read-only and containers are copied
+    first = _load_structure(str(datafile), 10)
+    with pytest.raises(ValueError):
+        first[0][0] = 1
+    first.append(None)
+    second = _load_structure(str(datafile), 10)
+    assert len(second) == 2 and second[0] is first[0]
+    assert _CALLS == [10]
+
+    # sparse matrices are accounted for by the size of the disk entry
+    _load_structure(str(datafile), 10**5)
+    assert decorators.cache_stats()['memory_bytes'] > 10**6
+
+    # at most 2 entries are kept in memory
+    _load_structure(str(datafile), 20)
+    assert decorators.cache_stats()['memory_evictions'] == 1
+    _load_structure(str(datafile), 10)
+    assert decorators.cache_stats()['disk_hits'] == 1
+
+
+def test_cached_filefunc_disk_tier(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    monkeypatch.setattr(decorators, 'CACHE_MEMORY_BUDGET', 0)
+    monkeypatch.setattr(decorators, 'CACHE_DISK_BUDGET', 25000)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    _load_block(str(datafile), 10000)
+    _load_block(str(datafile), 11000)
+    # make the first entry the most recently used one
+    oldest = time.time() - 100
+    for name in os.listdir(decorators.CACHEDIR):
+        path = os.path.join(decorators.CACHEDIR, name)
+        if name.endswith('.pkl'):
+            os.utime(path, (oldest, oldest))
+    _load_block(str(datafile), 10000)
+
+    # adding a third block removes the least recently used one
+    _load_block(str(datafile), 12000)
+    assert decorators.cache_stats()['disk_evictions'] == 1
+    _load_block(str(datafile), 10000)
+    _load_block(str(datafile), 11000)
+    assert _CALLS == [10000, 11000, 12000, 11000]
+
+
+def test_cached_filefunc_memory_hits_evict(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    monkeypatch.setattr(decorators, 'CACHE_DISK_BUDGET', 25000)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    _load_block(str(datafile), 10000)
+    _load_block(str(datafile), 11000)
+    # hits in memory count as use of the disk entry
+    for _ in range(5):
+        _load_block(str(datafile), 10000)
+    assert decorators.cache_stats()['memory_hits'] == 5
+
+    _load_block(str(datafile), 12000)
+    assert decorators.cache_stats()['disk_evictions'] == 1
+    _load_block(str(datafile), 10000)
+    assert _CALLS == [10000, 11000, 12000]
+
+
+def _digest(val):
+    hasher = hashlib.blake2b()
+    decorators._hash_value(hasher, val)
+    return hasher.hexdigest()
+
+
+@pytest.mark.filterwarnings('ignore::PendingDeprecationWarning')
+def test_hash_value():
+    a = np.arange(12.).reshape((3, 4))
+    assert _digest(a) == _digest(a.copy())
+    assert _digest(a.T) == _digest(np.ascontiguousarray(a.T))
+    assert _digest(a) != _digest(a.reshape((4, 3)))
+    assert _digest(a) != _digest(a.astype(np.float32))
+    assert _digest(a) != _digest(a.astype('>f8'))
+    # structured dtypes with the same itemsize and bytes
+    rec = np.zeros(3, dtype=[('a', '<i8'), ('b', '<f8')])
+    assert _digest(rec) != _digest(rec.view([('x', '<f8'), ('y', '<i8')]))
+    assert _digest(rec) != _digest(rec.view([('b', '<i8'), ('a', '<f8')]))
+    assert _digest(rec) == _digest(rec.copy())
+    # subclasses with additional state
+    masked = np.ma.masked_array(np.arange(4), mask=[0, 1, 0, 0])
+    assert _digest(masked) != _digest(np.ma.masked_array(np.arange(4)))
+    assert _digest(masked) == _digest(masked.copy())
+    assert _digest(np.matrix(a)) != _digest(a)
+    assert _digest(np.float64(1.)) != _digest(np.array(1.))
+    # arrays with equal repr (summarized by numpy) must not collide
+    b = np.zeros(10000)
+    c = b.copy()
+    c[5000] = 1
+    assert repr(b) == repr(c) and _digest(b) != _digest(c)
+
+    assert _digest({'a': 1, 'b': [2, 3]}) == _digest({'b': [2, 3], 'a': 1})
+    assert _digest({1, 2, 3}) == _digest({3, 2, 1})
+    assert _digest((1, 2)) != _digest([1, 2])
+    assert _digest(1) != _digest(1.) != _digest(True)
+    assert _digest(('ab', 'c')) != _digest(('a', 'bc'))
+
+
+@memoize
+def _build(matrix, power=2, **kwargs):
+    _CALLS.append(power)
+    return np.linalg.matrix_power(matrix, power)
+
+
+def test_memoize(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    matrix = np.random.randn(4, 4)
+
+    val = _build(matrix)
+    np.testing.assert_allclose(val, matrix.dot(matrix))
+    # default values are resolved
+    assert _build(matrix, power=2) is val
+    assert _build(matrix.copy(), 2) is val
+    assert _CALLS == [2]
+
+    _build(matrix, 3)
+    _build(matrix, 2, tag='x')
+    matrix[0, 0] += 1
+    np.testing.assert_allclose(_build(matrix), matrix.dot(matrix))
+    assert _CALLS == [2, 3, 2, 2]
+
+    # values are reused across runs from disk
+    decorators.clear_memory_cache()
+    np.testing.assert_allclose(_build(matrix), matrix.dot(matrix))
+    assert decorators.cache_stats()['disk_hits'] == 1
+    assert len(_CALLS) == 4
+
+
+@cached_filefunc
+def _load_slowly(filename, counter):
+    with open(counter, 'a') as outfile:
+        outfile.write('x')
+    time.sleep(0.3)
+    return np.arange(100)
+
+
+def _load_concurrently(filename, counter):
+    assert (_load_slowly(filename, counter) == np.arange(100)).all()
+
+
+def test_cached_filefunc_concurrent(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+    counter = str(cachedir / 'counter.txt')
+
+    procs = [Process(target=_load_concurrently, args=(str(datafile), counter))
+             for _ in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    assert all(proc.exitcode == 0 for proc in procs)
+    # the value is computed once and no temporary files are left behind
+    with open(counter) as infile:
+        assert infile.read() == 'x'
+    assert not [name for name in os.listdir(decorators.CACHEDIR)
+                if name.endswith('.tmp')]
+
+
+def test_cached_filefunc_threads(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    datafiles = []
+    for n in range(200):
+        datafiles.append(cachedir / 'data{}.txt'.format(n))
+        _write(datafiles[-1], 'a' * n)
+
+    with ThreadPoolExecutor(16) as executor:
+        results = list(executor.map(lambda path: _load(str(path)),
+                                    datafiles))
+    assert results == list(range(200))
+    assert len(decorators._fingerprint_index()) == 201
+    assert not [name for name in os.listdir(decorators.CACHEDIR)
+                if name.endswith('.tmp')]
+
+
+def test_fingerprint_index(cachedir, monkeypatch):
+    saves = []
+    save = decorators._save_fingerprint_index
+    monkeypatch.setattr(decorators, '_save_fingerprint_index',
+                        lambda path: saves.append(path) or save(path))
+    datafiles = []
+    for n in range(50):
+        datafiles.append(cachedir / 'data{}.txt'.format(n))
+        _write(datafiles[-1], 'a' * n)
+        decorators._fingerprint_file(str(datafiles[-1]))
+    # the index is not rewritten for every new fingerprint
+    assert len(saves) < 5
+
+    # entries of other processes are merged and deleted files are dropped
+    indexpath = os.path.join(decorators.CACHEDIR, decorators.FINGERPRINT_INDEX)
+    other = decorators._load_fingerprint_index(indexpath)
+    other[os.path.abspath(__file__)] = (0, 0, 0, 'hash')
+    with open(indexpath, 'wb') as outfile:
+        pickle.dump(other, outfile)
+    os.remove(str(datafiles[0]))
+    decorators._flush_fingerprint_indices()
+
+    index = decorators._load_fingerprint_index(indexpath)
+    assert sorted(index) == sorted([os.path.abspath(__file__)]
+                                   + [str(path) for path in datafiles[1:]])
+    assert decorators._fingerprint_index() == index
+
+
+def test_atomic_dump(cachedir):
+    def fail(val, path, compress):
+        decorators._dump_numpy(val, path, compress)
+        raise KeyboardInterrupt()
+
+    decorators.mkdir(decorators.CACHEDIR)
+    path = os.path.join(decorators.CACHEDIR, 'entry.npd')
+    with pytest.raises(KeyboardInterrupt):
+        decorators._atomic_dump(fail, np.ones(3), path, False)
+    assert os.listdir(decorators.CACHEDIR) == []
+
+    # incomplete entries (without manifest) are replaced
+    os.mkdir(path)
+    decorators._atomic_dump(decorators._dump_numpy, np.ones(3), path, False)
+    assert (decorators._load_numpy(path) == 1).all()
+
+
+def test_cached_filefunc_cleanup(cachedir, monkeypatch):
+    monkeypatch.setattr(decorators, '_RACY_MTIME_NS', -1)
+    monkeypatch.setattr(decorators, 'CACHE_MEMORY_BUDGET', 0)
+    monkeypatch.setattr(decorators, 'CACHE_DISK_BUDGET', 25000)
+    datafile = cachedir / 'data.txt'
+    _write(datafile, 'abc')
+
+    decorators.mkdir(decorators.CACHEDIR)
+    orphan = os.path.join(decorators.CACHEDIR, 'entry.pkl.x.tmp')
+    recent = os.path.join(decorators.CACHEDIR, 'other.pkl.y.tmp')
+    for path in (orphan, recent):
+        with open(path, 'w') as outfile:
+            outfile.write('x')
+    old = time.time() - 2 * 3600
+    os.utime(orphan, (old, old))
+    with open(os.path.join(decorators.CACHEDIR, 'missing.pkl.lock'), 'w'):
+        pass
+
+    for size in (10000, 11000, 12000):
+        _load_block(str(datafile), size)
+    names = os.listdir(decorators.CACHEDIR)
+    # the lock files of evicted and missing entries are removed
+    assert len([name for name in names if name.endswith('.pkl')]) == 3
+    locks = [name for name in names if name.endswith('.lock')]
+    assert 'missing.pkl.lock' not in locks
+    assert sorted(name[:-len('.lock')] for name in locks) \
+        == sorted(name for name in names if name.endswith('.pkl'))
+    assert [name for name in names if name.endswith('.tmp')] \
+        == ['other.pkl.y.tmp']
+
+
+def test_atomic_dump_threads(cachedir):
+    decorators.mkdir(decorators.CACHEDIR)
+    path = os.path.join(decorators.CACHEDIR, 'entry.npd')
+
+    def dump(n):
+        decorators._atomic_dump(decorators._dump_numpy, np.full(10**4, n),
+                                path, False)
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(dump, range(32)))
+    val = decorators._load_numpy(path)
+    assert (val == val[0]).all()
+    assert os.listdir(decorators.CACHEDIR) == ['entry.npd']
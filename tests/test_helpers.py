@@ -0,0 +1,227 @@
+import csv
+import io
+import itertools as it
+import json
+import time
+
+import pytest
+
+import tools.helpers as helpers
+from tools.helpers import CountProgress, Timer
+
+
+@pytest.fixture
+def timings(monkeypatch):
+    monkeypatch.setattr(helpers, '_TIMINGS', {})
+    return helpers._TIMINGS
+
+
+def test_timer(timings, capsys):
+    with Timer('outer') as timer:
+        for _ in range(3):
+            with Timer('inner', verbose=False):
+                pass
+    assert capsys.readouterr().out.startswith('outer: ')
+    assert timer.elapsed > 0
+
+    stats = helpers.timing_stats()
+    assert sorted(stats) == ['outer', 'outer/inner']
+    assert stats['outer']['count'] == 1
+    assert stats['outer/inner']['count'] == 3
+    assert stats['outer/inner']['total'] <= stats['outer']['total']
+
+
+def test_timer_decorator(timings, monkeypatch):
+    @Timer('func', verbose=False)
+    def func(x):
+        return 2 * x
+
+    assert func.__name__ == 'func'
+    assert [func(x) for x in range(10)] == list(range(0, 20, 2))
+    assert helpers.timing_stats()['func']['count'] == 10
+
+    monkeypatch.setattr(helpers, 'TIMING_ENABLED', False)
+    assert func(1) == 2
+    with Timer('disabled'):
+        pass
+    assert list(helpers.timing_stats()) == ['func']
+    assert helpers.timing_stats()['func']['count'] == 10
+
+
+def test_timer_toggle(timings, monkeypatch):
+    # timers record if TIMING_ENABLED is set when entering the block
+    with Timer('outer', verbose=False):
+        monkeypatch.setattr(helpers, 'TIMING_ENABLED', False)
+        with Timer('disabled', verbose=False):
+            monkeypatch.setattr(helpers, 'TIMING_ENABLED', True)
+            with Timer('inner', verbose=False):
+                pass
+    with Timer('after', verbose=False):
+        pass
+
+    assert sorted(helpers.timing_stats()) == ['after', 'outer',
+                                              'outer/inner']
+    assert helpers._section_stack() == []
+
+
+def test_timing_percentiles():
+    stats = helpers._TimingStats()
+    for duration in range(1, 10001):
+        stats.add(duration * 1000)
+    assert stats.min == 1000 and stats.max == 10**7
+    for q in (10, 50, 90, 99):
+        assert abs(stats.percentile(q) / (q * 10**5) - 1) < 0.05
+    assert stats.percentile(100) == stats.max
+
+
+def test_export_timings(timings, tmp_path):
+    for _ in range(2):
+        with Timer('a', verbose=False):
+            with Timer('b', verbose=False):
+                pass
+
+    helpers.export_timings(str(tmp_path / 'timings.json'))
+    with open(str(tmp_path / 'timings.json')) as infile:
+        rows = json.load(infile)
+    assert [row['section'] for row in rows] == ['a', 'a/b']
+    assert rows[1]['count'] == 2
+
+    helpers.export_timings(str(tmp_path / 'timings.csv'))
+    with open(str(tmp_path / 'timings.csv')) as infile:
+        rows = list(csv.DictReader(infile))
+    assert [row['section'] for row in rows] == ['a', 'a/b']
+    assert set(rows[0]) == set(helpers.TIMING_FIELDS)
+
+    with pytest.raises(ValueError):
+        helpers.export_timings(str(tmp_path / 'timings.txt'))
+
+
+class _Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@pytest.mark.parametrize('fd', [_Terminal, io.StringIO])
+def test_count_progress(fd):
+    out = fd()
+    assert list(CountProgress(range(1000), fd=out)) == list(range(1000))
+    assert '100%' in out.getvalue()
+
+    # unsized iterables and breaking out of the loop
+    for n in CountProgress(iter(range(1000)), fd=fd()):
+        if n == 10:
+            break
+
+
+class _Clock(object):
+    """Fake `time` module whose clock advances by `step` per item drawn
+    from `ticking`"""
+
+    def __init__(self, step):
+        self.step = step
+        self.now = 0.
+        self.reads = 0
+
+    def perf_counter(self):
+        self.reads += 1
+        return self.now
+
+    def ticking(self, size):
+        for n in range(size):
+            self.now += self.step
+            yield n
+
+
+def test_count_progress_throttling(monkeypatch):
+    clock = _Clock(1e-4)
+    monkeypatch.setattr(helpers, 'time', clock)
+    updates = []
+
+    class Progress(CountProgress):
+        # records the updates issued while iterating
+        def _iter_throttled(self):
+            self.update = lambda value: updates.append(value)
+            yield from super()._iter_throttled()
+            del self.update
+
+    size, min_interval = 10**5, 0.01
+    assert list(Progress(clock.ticking(size), max_value=size, fd=_Terminal(),
+                         min_interval=min_interval)) == list(range(size))
+
+    # one update per min_interval, but the clock is not read every iteration
+    duration = size * clock.step
+    assert duration / (2 * min_interval) < len(updates) \
+        <= duration / min_interval
+    assert all(b - a >= min_interval / clock.step
+               for a, b in zip(updates, updates[1:]))
+    assert clock.reads < size / 10
+
+    # non-terminal output does not read the clock at all
+    clock.reads, updates[:] = 0, []
+    assert list(Progress(clock.ticking(100), fd=io.StringIO())) \
+        == list(range(100))
+    assert clock.reads == 0 and updates == []
+
+
+def _square(x):
+    return x * x
+
+
+def _sleep_square(x):
+    time.sleep(0.001 * (x % 3))
+    return x * x
+
+
+@pytest.mark.parametrize('threads', [True, False])
+def test_pmap(threads):
+    results = helpers.pmap(_square, range(100), processes=2, threads=threads,
+                           progress=False)
+    assert list(results) == [x * x for x in range(100)]
+
+    results = helpers.pmap(_sleep_square, iter(range(50)), processes=3,
+                           threads=threads, ordered=False, fd=io.StringIO())
+    assert sorted(results) == [x * x for x in range(50)]
+
+
+def test_pmap_chunksize(monkeypatch):
+    chunks = []
+    _run_chunk = helpers._run_chunk
+
+    def run_chunk(func, chunk):
+        chunks.append(len(chunk))
+        return _run_chunk(func, chunk)
+
+    monkeypatch.setattr(helpers, '_run_chunk', run_chunk)
+    results = helpers.pmap(_square, range(1000), processes=2, threads=True,
+                           progress=False)
+    assert list(results) == [x * x for x in range(1000)]
+    # fast items are processed in growing chunks, but at least 8 chunks
+    # remain for balancing the load between the workers
+    assert chunks[0] == 1 and max(chunks) > 1 and max(chunks) <= 125
+
+    del chunks[:]
+    list(helpers.pmap(_square, range(100), processes=2, threads=True,
+                      chunksize=30, progress=False))
+    assert chunks == [30, 30, 30, 10]
+
+
+def test_pmap_lazy():
+    # infinite iterables are consumed lazily and can be stopped early
+    results = helpers.pmap(_square, it.count(), processes=2, threads=True,
+                           progress=False)
+    assert [next(results) for _ in range(10)] == [x * x for x in range(10)]
+    results.close()
+
+    with pytest.raises(ZeroDivisionError):
+        list(helpers.pmap(lambda x: 1 / (x - 5), range(10), processes=2,
+                          threads=True, progress=False))
+
+
+def test_pmap_runtime_slice():
+    budget = helpers.RuntimeSlice(it.count(), 0.2)
+    start = time.perf_counter()
+    results = list(helpers.pmap(_sleep_square, budget, processes=2,
+                                threads=True, fd=_Terminal()))
+    assert time.perf_counter() - start < 2
+    assert results == [x * x for x in range(len(results))]
+    assert len(results) > 10
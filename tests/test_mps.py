@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+
+import physics.qstat as qs
+from physics.mps import MPS
+
+
+def _random_vector(dim):
+    return np.random.randn(dim) + 1j * np.random.randn(dim)
+
+
+@pytest.mark.parametrize("dims", [(2,), (2, 2, 2), (2, 3, 4), (3, 1, 2, 2)])
+def test_product(dims):
+    xs = [_random_vector(dim) for dim in dims]
+    mps = MPS.from_product(xs)
+    assert np.allclose(mps.to_vector(), qs.tensor(xs))
+
+    for pos, dim in enumerate(dims):
+        op = np.random.randn(dim, dim)
+        assert np.allclose(mps.apply_local(op, pos).to_vector(),
+                           qs.embed(op, pos, dims).dot(qs.tensor(xs)))
+
+
+@pytest.mark.parametrize("dims", [(2, 2, 2, 2, 2), (2, 3, 4), (3, 1, 2, 2)])
+def test_from_vector(dims):
+    psi = _random_vector(int(np.prod(dims)))
+    phi = _random_vector(int(np.prod(dims)))
+    mps = MPS.from_vector(psi, dims)
+    other = MPS.from_vector(phi, dims)
+
+    assert np.allclose(mps.to_vector(), psi)
+    assert np.allclose(mps.compress().to_vector(), psi)
+    assert np.allclose(mps.overlap(other), np.vdot(psi, phi))
+    assert np.allclose(mps.norm(), np.linalg.norm(psi))
+
+    for pos, dim in enumerate(dims):
+        op = np.random.randn(dim, dim)
+        expected = np.vdot(psi, qs.embed(op, pos, dims).dot(psi)) \
+            / np.vdot(psi, psi)
+        assert np.allclose(mps.expectation(op, pos), expected)
+
+
+def test_compress():
+    dims = (2,) * 8
+    psi = _random_vector(2**8)
+    mps = MPS.from_vector(psi, dims)
+    assert max(mps.bond_dims) == 16
+
+    fidelities = []
+    for max_bond in (1, 2, 4, 8, 16):
+        truncated = mps.compress(max_bond=max_bond)
+        assert max(truncated.bond_dims) <= max_bond
+        assert max(MPS.from_vector(psi, dims, max_bond).bond_dims) <= max_bond
+        phi = truncated.to_vector()
+        fidelities.append(np.abs(np.vdot(phi, psi))
+                          / np.linalg.norm(phi) / np.linalg.norm(psi))
+
+    assert np.all(np.diff(fidelities) > 0)
+    assert np.allclose(fidelities[-1], 1)
@@ -0,0 +1,49 @@
+import pytest
+import numpy as np
+from itertools import product
+
+import physics.qstat as qs
+from physics.qmech import PAULI
+from physics.pauli import PauliString, expectation_values
+
+
+def _random_strings(nr_qubits, count):
+    return [PauliString(np.random.randint(2**nr_qubits),
+                        np.random.randint(2**nr_qubits),
+                        np.random.randint(4), nr_qubits)
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize("nr_qubits", range(1, 4))
+def test_labels(nr_qubits):
+    for label in product('IXYZ', repeat=nr_qubits):
+        string = PauliString.from_label(''.join(label))
+        assert repr(string) == ''.join(label)
+        assert np.allclose(string.to_dense(),
+                           qs.tensor([PAULI['IXYZ'.index(c)] for c in label]))
+
+
+@pytest.mark.parametrize("nr_qubits", range(1, 6))
+def test_algebra(nr_qubits):
+    strings = _random_strings(nr_qubits, 20)
+    for A, B in product(strings, strings):
+        prod = A.to_dense().dot(B.to_dense())
+        assert np.allclose((A * B).to_dense(), prod)
+        comm = prod - B.to_dense().dot(A.to_dense())
+        assert A.commutes(B) == np.allclose(comm, 0)
+
+
+@pytest.mark.parametrize("nr_qubits", range(1, 8))
+def test_apply(nr_qubits):
+    strings = _random_strings(nr_qubits, 50)
+    psi = np.random.randn(2**nr_qubits) + 1j * np.random.randn(2**nr_qubits)
+    psi /= np.linalg.norm(psi)
+    psis = np.random.randn(3, 2**nr_qubits)
+
+    for string in strings:
+        assert np.allclose(string.apply(psi), string.to_dense().dot(psi))
+        assert np.allclose(string.apply(psis), string.to_dense().dot(psis.T).T)
+
+    expected = [np.vdot(psi, string.to_dense().dot(psi)) for string in strings]
+    assert np.allclose(expectation_values(strings, psi), expected)
+    assert np.allclose(expectation_values(strings, psi, chunksize=1), expected)
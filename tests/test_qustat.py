@@ -1,7 +1,7 @@
 import pytest
 import numpy as np
 import scipy.sparse as sp
-from itertools import product
+from itertools import combinations, permutations, product
 
 import physics.qstat as qs
 
@@ -30,3 +30,168 @@ def test_embed(dim):
     assert (qs.embed(op, 0, 3) == qs.tensor((op, idm, idm))).all()
     assert (qs.embed(op, 1, 3) == qs.tensor((idm, op, idm))).all()
     assert (qs.embed(op, 2, 3) == qs.tensor((idm, idm, op))).all()
+
+
+@pytest.mark.parametrize("dims", [(2, 2, 2), (2, 3, 4), (3, 1, 2, 2)])
+def test_embed_operator(dims):
+    for pos, dim in enumerate(dims):
+        op = np.random.randn(dim, dim) + 1j * np.random.randn(dim, dim)
+        full = qs.embed(op, pos, dims)
+        linop = qs.embed_operator(op, pos, dims)
+
+        psi = np.random.randn(full.shape[0])
+        assert np.allclose(linop.matvec(psi), full.dot(psi))
+        assert np.allclose(linop.rmatvec(psi), full.conj().T.dot(psi))
+
+        psis = np.random.randn(full.shape[0], 5)
+        assert np.allclose(linop.matmat(psis), full.dot(psis))
+        assert np.allclose(qs.apply_embedded(op, pos, dims, psis.T),
+                           full.dot(psis).T)
+        assert np.allclose(qs.apply_embedded(sp.csr_matrix(op), pos, dims, psi),
+                           full.dot(psi))
+
+
+@pytest.mark.parametrize("n_sites", range(0, 5))
+def test_tensor_batch(n_sites):
+    xs = np.random.randn(6, n_sites, 3) + 1j * np.random.randn(6, n_sites, 3)
+    out = np.empty((6, 3**n_sites), dtype=complex)
+    res = qs.tensor_batch(xs, out=out)
+
+    assert res is out
+    for x, vec in zip(xs, res):
+        assert np.allclose(vec, qs.tensor(list(x)))
+
+
+def _symmetrize_naive(xs, antisymmetric):
+    perms, signs = qs.permutation_table(len(xs))
+    return sum([(sign if antisymmetric else 1) * qs.tensor(xs[sigma])
+                for sigma, sign in zip(perms, signs)]) / len(perms)
+
+
+@pytest.mark.parametrize("nr_factors", range(1, 6))
+def test_symmtensor(nr_factors):
+    xs = np.random.randn(nr_factors, 3) + 1j * np.random.randn(nr_factors, 3)
+    assert np.allclose(qs.symmtensor(xs), _symmetrize_naive(xs, False))
+
+
+@pytest.mark.parametrize("nr_factors", range(1, 6))
+def test_wedgetensor(nr_factors):
+    xs = np.random.randn(nr_factors, 5) + 1j * np.random.randn(nr_factors, 5)
+    assert np.allclose(qs.wedgetensor(xs), _symmetrize_naive(xs, True))
+
+
+@pytest.mark.parametrize("nr_items", range(0, 7))
+def test_permutations(nr_items):
+    perms = list(qs.permutations('abcdefg'[:nr_items]))
+    assert len(perms) == len(set(perms)) == len(list(permutations(range(nr_items))))
+    assert perms[0] == (tuple('abcdefg'[:nr_items]), 1)
+
+    for perm, sign in perms:
+        # compute the signature from the number of inversions
+        inversions = sum(a > b for a, b in combinations(perm, 2))
+        assert sign == (-1)**inversions
+
+    table, signs = qs.permutation_table(nr_items)
+    assert qs.permutation_table(nr_items)[0] is table
+    assert [tuple(p) for p in table] == \
+        [p for p, _ in qs.permutations(range(nr_items))]
+    assert list(signs) == [s for _, s in perms]
+
+
+@pytest.mark.parametrize("nr_fermions", range(1, 8))
+def test_annhilators_kron(nr_fermions):
+    iden = sp.identity(2)
+    eta = sp.spdiags([[1, -1]], [0], 2, 2)
+    annh = sp.csr_matrix([[0, 1], [0, 0]])
+
+    for n, A in enumerate(qs.annhilation_operators(nr_fermions)):
+        B = qs.tensor([eta] * n + [annh] + [iden] * (nr_fermions - 1 - n),
+                      sp.kron)
+        assert (A != B).nnz == 0
+        assert A.nnz == 2**(nr_fermions - 1)
+
+
+def test_annhilators_cache():
+    A = qs.annhilation_operators(3)[0]
+    assert qs.annhilation_operators(3)[0] is A
+    with pytest.raises(ValueError):
+        A *= 2
+    assert (A.data ** 2 == 1).all()
+    B = A.copy()
+    B *= 2
+    assert (abs(B.data) == 2).all()
+    # operations creating new matrices work as usual
+    assert ((2 * A).dot(A.T) - 2 * A.dot(A.T)).nnz == 0
+
+    qs.clear_annhilation_cache()
+    assert qs.annhilation_operators(3)[0] is not A
+
+
+@pytest.mark.parametrize("nr_fermions", range(1, 7))
+def test_sectors(nr_fermions):
+    annh = qs.annhilation_operators(nr_fermions)
+    states = np.arange(2**nr_fermions)
+    occupations = np.array([bin(s).count('1') for s in states])
+
+    for nr_particles in range(nr_fermions + 1):
+        basis = qs.sector_basis(nr_fermions, nr_particles)
+        assert (basis == states[occupations == nr_particles]).all()
+        assert (qs.sector_rank(basis, nr_fermions) == np.arange(len(basis))).all()
+        assert (qs.sector_unrank(np.arange(len(basis)), nr_fermions,
+                                 nr_particles) == basis).all()
+
+        for i, j in product(range(nr_fermions), range(nr_fermions)):
+            full = (annh[i].conj().T * annh[j]).toarray()
+            hop = qs.hopping_operator(i, j, nr_fermions, nr_particles)
+            assert np.allclose(hop.toarray(), full[basis][:, basis])
+
+
+@pytest.mark.parametrize("nr_fermions", range(1, 5))
+def test_hamiltonian(nr_fermions):
+    shape = (nr_fermions,) * 2
+    hopping = np.random.randn(*shape) + 1j * np.random.randn(*shape)
+    interaction = np.random.randn(*(shape * 2))
+    interaction[np.abs(interaction) < .5] = 0
+
+    annh = qs.annhilation_operators(nr_fermions)
+    crea = [A.conj().T for A in annh]
+    modes = range(nr_fermions)
+    ham = sum(hopping[i, j] * crea[i] * annh[j] for i, j in product(modes, modes))
+    ham = ham + sum(interaction[i, j, k, l] * crea[i] * crea[j] * annh[k] * annh[l]
+                    for i, j, k, l in product(*(modes,) * 4))
+
+    assert np.allclose(qs.hamiltonian(hopping, interaction).toarray(),
+                       ham.toarray())
+    assert np.allclose(qs.hamiltonian(hopping, chunksize=3).toarray(),
+                       sum(hopping[i, j] * crea[i] * annh[j]
+                           for i, j in product(modes, modes)).toarray())
+
+    for nr_particles in range(nr_fermions + 1):
+        basis = qs.sector_basis(nr_fermions, nr_particles)
+        sector_ham = qs.hamiltonian(hopping, interaction, nr_particles)
+        assert np.allclose(sector_ham.toarray(), ham.toarray()[basis][:, basis])
+
+
+@pytest.mark.parametrize("dims", [(2, 2, 2), (2, 3, 4), (3, 1, 2, 2)])
+def test_reduced_density_matrix(dims):
+    xs = [np.random.randn(dim) + 1j * np.random.randn(dim) for dim in dims]
+    xs = [x / np.linalg.norm(x) for x in xs]
+    psi = qs.tensor(xs)
+
+    for keep in ([0], [1, 2], [2, 0], list(range(len(dims)))):
+        reduced = qs.tensor([xs[pos] for pos in keep])
+        assert np.allclose(qs.reduced_density_matrix(psi, keep, dims),
+                           np.outer(reduced, reduced.conj()))
+
+    # entangled states: compare to partial trace of the full density matrix
+    psis = np.random.randn(3, len(psi)) + 1j * np.random.randn(3, len(psi))
+    keep = [len(dims) - 1]
+    rhos = qs.reduced_density_matrix(psis, keep, dims)
+    traced = int(np.prod(dims[:-1]))
+    for rho, state in zip(rhos, psis):
+        full = np.outer(state, state.conj()).reshape((dims[-1], traced) * 2)
+        assert np.allclose(rho, np.einsum('ijkj->ik', full))
+
+    if len(set(dims)) == 1:
+        assert np.allclose(qs.reduced_density_matrix(psi, [1], len(dims)),
+                           np.outer(xs[1], xs[1].conj()))
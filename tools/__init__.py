@@ -0,0 +1,11 @@
+import errno
+import os
+
+
+def mkdir(dirname):
+    """Create dir if it doesnt exist."""
+    try:
+        os.makedirs(dirname)
+    except OSError as exception:
+        if exception.errno != errno.EEXIST:
+            raise
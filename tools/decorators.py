@@ -4,71 +4,355 @@
 
 from __future__ import division, print_function
 
-import base64
+import atexit
+import contextlib
+import errno
 import hashlib
+import importlib
+import inspect
 import itertools as it
 import os
 import pickle
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import traceback
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from functools import wraps
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, get_start_method
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
 
 from . import mkdir
 
+try:
+    import fcntl
+except ImportError:
+    # no file locking (e.g. on Windows): concurrent misses are computed
+    # several times, but the cache entries are still written atomically
+    fcntl = None
+
 CACHEDIR = '.pycache'
+FINGERPRINT_INDEX = 'fingerprints.pkl'
+# File marking a complete cache entry of the 'numpy' storage
+MANIFEST = 'manifest.pkl'
+# Maximal size of the arrays stored compressed by the 'numpy' storage
+COMPRESS_MAX_BYTES = 2**24
+# Budgets of the in-process and the disk tier of cached_filefunc in bytes
+# and the maximal number of entries in memory (None: unlimited)
+CACHE_MEMORY_BUDGET = 2**28
+CACHE_DISK_BUDGET = 2**34
+CACHE_MEMORY_ENTRIES = 1024
+# Arrays with at least that many bytes are passed to/from processify'd
+# functions through shared memory instead of being pickled
+SHM_THRESHOLD = 2**20
+
+
+def _current_error():
+    """Returns (exception type, exception value, formatted traceback) of the
+    exception currently being handled."""
+    ex_type, ex_value, tb = sys.exc_info()
+    return ex_type, ex_value, ''.join(traceback.format_tb(tb))
+
+
+def _call_catching(func, args, kwargs):
+    """Calls func(*args, **kwargs) and catches all exceptions.
+
+    :returns: (return value, None) on success and (None, error) otherwise,
+        where error is given by `_current_error`
+    """
+    try:
+        return func(*args, **kwargs), None
+    except Exception:
+        return None, _current_error()
+
+
+def _subprocess_exception(error):
+    """Recreates the exception described by `error` (see `_call_catching`)
+    including the traceback from the subprocess in its message."""
+    ex_type, ex_value, tb_str = error
+    message = '%s (in subprocess)\n%s' % (ex_value, tb_str)
+    return ex_type(message)
+
+
+class _SharedArray(object):
+
+    """Picklable handle to an array stored in a shared-memory segment"""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
 
 
-def processify(func):
+class _SegmentOwner(object):
+
+    """Exposes a shared-memory segment as array buffer.
+    Arrays created from it keep the owner as base, so the segment stays
+    mapped exactly as long as it is used."""
+
+    def __init__(self, shm, shape, dtype):
+        self._shm = shm
+        address = np.frombuffer(shm.buf, dtype=np.uint8).ctypes.data
+        self.__array_interface__ = {'shape': shape, 'typestr': dtype.str,
+                                    'descr': dtype.descr, 'version': 3,
+                                    'data': (address, False)}
+
+
+def _map_leaves(obj, func):
+    """Recursively applies `func` to all objects in `obj`, which are not
+    lists, tuples or dicts (and returns the result with the same structure).
+    """
+    if type(obj) in (list, tuple):
+        return type(obj)(_map_leaves(val, func) for val in obj)
+    if type(obj) is dict:
+        return {key: _map_leaves(val, func) for key, val in obj.items()}
+    return func(obj)
+
+
+def _share(obj, segments):
+    """Recursively replaces all large arrays in `obj` (and in lists, tuples
+    and dicts contained therein) by handles to shared-memory copies. Only
+    plain ndarrays are shared; subclasses such as masked arrays are pickled
+    as usual.
+
+    :param obj: Object to share
+    :param segments: List, to which the newly created segments are appended
+    :returns: `obj` with arrays replaced by `_SharedArray`
+    """
+    def share(val):
+        if type(val) is not np.ndarray or val.dtype.hasobject \
+                or val.nbytes < max(SHM_THRESHOLD, 1):
+            return val
+        shm = SharedMemory(create=True, size=val.nbytes)
+        segments.append(shm)
+        np.ndarray(val.shape, val.dtype, buffer=shm.buf)[...] = val
+        return _SharedArray(shm.name, val.shape, val.dtype)
+
+    return _map_leaves(obj, share)
+
+
+def _unshare(obj, unlink=True):
+    """Inverse of `_share`. The arrays are backed by the segments, which stay
+    mapped as long as any view of them exists. If `unlink` is True, the
+    segments are unlinked right away, so the arrays own them; otherwise,
+    unlinking is left to the creator of the segments.
+    """
+    def unshare(val):
+        if not isinstance(val, _SharedArray):
+            return val
+        shm = SharedMemory(name=val.name)
+        if unlink:
+            shm.unlink()
+        return np.asarray(_SegmentOwner(shm, val.shape, val.dtype))
+
+    return _map_leaves(obj, unshare)
+
+
+def _release(segments, unlink):
+    """Closes (and unlinks) the shared-memory `segments`."""
+    for shm in segments:
+        shm.close()
+        if unlink:
+            shm.unlink()
+
+
+def _call_shared(func, args, kwargs):
+    """Same as `_call_catching`, but arrays in the arguments and the return
+    value are passed as shared memory (see `_share`). The argument segments
+    are unlinked by the caller once the call has finished, but stay mapped
+    in this process as long as views of them are used (e.g. in the return
+    value or in a cache)."""
+    ret, error = _call_catching(func, *_unshare((args, kwargs), unlink=False))
+    del args, kwargs
+
+    result_segments = []
+    try:
+        ret = _share(ret, result_segments)
+    except Exception:
+        _release(result_segments, unlink=True)
+        ret, error = None, _current_error()
+    _release(result_segments, unlink=False)
+    return ret, error
+
+
+def _call_pooled(module, qualname, args, kwargs):
+    """Runs the function decorated by `processify(pool=True)`, which is
+    looked up by its module and qualified name (importing the module if
+    necessary), with `_call_shared`."""
+    func = importlib.import_module(module)
+    for name in qualname.split('.'):
+        func = getattr(func, name)
+    return _call_shared(getattr(func, '__wrapped__', func), args, kwargs)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def _get_pool(processes, maxtasksperchild):
+    """Returns the persistent worker pool with the given configuration."""
+    key = (processes, maxtasksperchild)
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            # workers have to share the resource tracker of the parent,
+            # otherwise their shared-memory results are removed when they
+            # exit
+            resource_tracker.ensure_running()
+            _POOLS[key] = ProcessPoolExecutor(
+                processes, max_tasks_per_child=maxtasksperchild)
+        return _POOLS[key]
+
+
+def _drop_pool(pool):
+    """Removes the (broken) `pool` so the next call creates a new one."""
+    with _POOLS_LOCK:
+        for key, val in list(_POOLS.items()):
+            if val is pool:
+                del _POOLS[key]
+
+
+def shutdown_pools():
+    """Terminates all worker pools created by `processify(pool=True)`."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in pools:
+        pool.shutdown(wait=True)
+
+
+atexit.register(shutdown_pools)
+
+
+def processify(func=None, pool=False, processes=None, maxtasksperchild=None):
     """Decorator to run a function as a process.  Be sure that every argument
     and the return value is *pickable*. The created process is joined, so the
     code does not run in parallel.
 
+    With `pool=True`, the function is run in a persistent worker pool instead
+    and the decorated function immediately returns a
+    concurrent.futures.Future. Hence, the start-up cost of a new process is
+    only paid once per worker and several calls run in parallel. Pools are
+    shared between all functions decorated with the same `processes` and
+    `maxtasksperchild`; the workers look up the function by its module and
+    qualified name, so it has to be defined at the top level of a module.
+    Exceptions are forwarded with the traceback from the subprocess in both
+    modes. If a worker dies, the future raises BrokenProcessPool.
+
+    NumPy arrays with at least SHM_THRESHOLD bytes, which are passed as
+    arguments or returned (also inside lists, tuples and dicts), are
+    transported through multiprocessing.shared_memory segments, so only their
+    shape, dtype and segment name are pickled. The subprocess works on views
+    of the argument segments and the returned arrays are backed by the
+    result segments without further copies. All segments are unlinked once
+    the call has finished, even if it raises an exception.
+
+    Usage:
+        @processify
+        def f(x): ...
+
+        @processify(pool=True, processes=4, maxtasksperchild=100)
+        def g(x): ...
+
+        results = [future.result() for future in [g(x) for x in xs]]
+
+    :param pool: Run in a persistent worker pool and return futures
+        (default False)
+    :param processes: Number of worker processes (default None: number of
+        CPUs)
+    :param maxtasksperchild: Number of tasks after which a worker is replaced
+        by a fresh process (default None: workers live as long as the pool).
+        Note that such pools use the 'spawn' start method.
+
     Taken from https://gist.github.com/schlamar/2311116
     """
+    if func is None:
+        return lambda f: processify(f, pool=pool, processes=processes,
+                                    maxtasksperchild=maxtasksperchild)
 
     def process_func(q, *args, **kwargs):
-        try:
-            ret = func(*args, **kwargs)
-        except Exception:
-            ex_type, ex_value, tb = sys.exc_info()
-            error = ex_type, ex_value, ''.join(traceback.format_tb(tb))
-            ret = None
-        else:
-            error = None
-
-        q.put((ret, error))
+        q.put(_call_shared(func, args, kwargs))
 
     # register original function with different name
     # in sys.modules so it is pickable
-    process_func.__name__ = func.__name__ + 'processify_func'
+    process_func.__name__ = process_func.__qualname__ = \
+        func.__name__ + 'processify_func'
     setattr(sys.modules[__name__], process_func.__name__, process_func)
 
     @wraps(func)
     def decorated(*args, **kwargs):
-        q = Queue()
-        p = Process(target=process_func, args=[q] + list(args), kwargs=kwargs)
-        p.start()
-        p.join()
-        ret, error = q.get()
+        # forked processes see the arguments without pickling them
+        segments = []
+        if get_start_method() != 'fork':
+            args, kwargs = _share((args, kwargs), segments)
+
+        try:
+            resource_tracker.ensure_running()
+            q = Queue()
+            p = Process(target=process_func, args=[q] + list(args),
+                        kwargs=kwargs)
+            p.start()
+            ret, error = q.get()
+            p.join()
+        finally:
+            _release(segments, unlink=True)
 
         if error:
-            ex_type, ex_value, tb_str = error
-            message = '%s (in subprocess)\n%s' % (ex_value.message, tb_str)
-            raise ex_type(message)
+            raise _subprocess_exception(error)
 
-        return ret
-    return decorated
+        return _unshare(ret)
+
+    @wraps(func)
+    def decorated_pool(*args, **kwargs):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        segments = []
+        args, kwargs = _share((args, kwargs), segments)
+
+        def callback(pool_future):
+            _release(segments, unlink=True)
+            try:
+                ret, error = pool_future.result()
+            except BrokenProcessPool as exception:
+                _drop_pool(executor)
+                future.set_exception(exception)
+                return
+            except Exception as exception:
+                future.set_exception(exception)
+                return
+
+            if error:
+                future.set_exception(_subprocess_exception(error))
+            else:
+                future.set_result(_unshare(ret))
+
+        executor = _get_pool(processes, maxtasksperchild)
+        try:
+            pool_future = executor.submit(_call_pooled, func.__module__,
+                                          func.__qualname__, args, kwargs)
+        except Exception:
+            _release(segments, unlink=True)
+            raise
+        pool_future.add_done_callback(callback)
+        return future
+
+    return decorated_pool if pool else decorated
 
 
 def _hash_file(filename, blocksize=65536):
     """Hashes the given file.
 
     :param filename: Path to file
-    :returns: Hex digest of the md5 checksum
+    :returns: Hex digest of the blake2b checksum
 
     """
-    hasher = hashlib.md5()
+    hasher = hashlib.blake2b(digest_size=16)
     with open(filename, 'rb') as infile:
         buf = infile.read(blocksize)
         while len(buf) > 0:
@@ -78,6 +362,460 @@ def _hash_file(filename, blocksize=65536):
     return hasher.hexdigest()
 
 
+# Files modified less than that many ns before hashing are not added to the
+# fingerprint index since a later modification might not change the mtime
+_RACY_MTIME_NS = 2 * 10**9
+_FINGERPRINTS = {}
+# index path -> {path: fingerprint} added since the last save
+_FINGERPRINT_UPDATES = {}
+# index path -> time of the last save (ns)
+_FINGERPRINT_SAVES = {}
+# The index is written at most that often (and at exit)
+_FINGERPRINT_SAVE_INTERVAL_NS = 10**9
+_FINGERPRINTS_LOCK = threading.RLock()
+
+
+def _fingerprint_index():
+    """Returns the fingerprint index of the current CACHEDIR, which maps
+    absolute paths to (size, mtime_ns, inode, hash). It is loaded from disk
+    once per process.
+    """
+    path = os.path.join(CACHEDIR, FINGERPRINT_INDEX)
+    with _FINGERPRINTS_LOCK:
+        if path not in _FINGERPRINTS:
+            _FINGERPRINTS[path] = _load_fingerprint_index(path)
+        return _FINGERPRINTS[path]
+
+
+def _load_fingerprint_index(path):
+    try:
+        with open(path, 'rb') as infile:
+            return pickle.load(infile)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        return {}
+
+
+def _save_fingerprint_index(path):
+    """Merges the fingerprints added by this process into the index `path`
+    on disk, which may have been changed by other processes in the
+    meantime, and drops the entries of files which do not exist anymore.
+    The index is written atomically while holding its entry lock. Has to be
+    called with _FINGERPRINTS_LOCK held. Since the index is only an
+    optimization, failures are ignored.
+    """
+    updates = _FINGERPRINT_UPDATES.pop(path, {})
+    _FINGERPRINT_SAVES[path] = time.time_ns()
+    tmppath = None
+    try:
+        mkdir(os.path.dirname(path))
+        with _entry_lock(path):
+            index = _load_fingerprint_index(path)
+            index.update(updates)
+            index = {key: val for key, val in index.items()
+                     if os.path.exists(key)}
+            fd, tmppath = tempfile.mkstemp(
+                prefix=os.path.basename(path) + '.', suffix='.tmp',
+                dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as outfile:
+                pickle.dump(index, outfile)
+            os.replace(tmppath, path)
+        _FINGERPRINTS[path] = index
+    except (OSError, pickle.PicklingError):
+        if tmppath is not None and os.path.exists(tmppath):
+            os.remove(tmppath)
+
+
+def _flush_fingerprint_indices():
+    """Saves all fingerprints, which have not been written yet."""
+    with _FINGERPRINTS_LOCK:
+        for path in list(_FINGERPRINT_UPDATES):
+            _save_fingerprint_index(path)
+
+
+atexit.register(_flush_fingerprint_indices)
+
+
+def _fingerprint_file(filename):
+    """Same as `_hash_file`, but reuses the hash stored in the fingerprint
+    index if the size, mtime and inode of the file did not change. Hence,
+    the file only has to be read if it was modified. New fingerprints are
+    written to disk at most every _FINGERPRINT_SAVE_INTERVAL_NS.
+
+    :param filename: Path to file
+    :returns: Hex digest of the blake2b checksum
+
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+    with _FINGERPRINTS_LOCK:
+        entry = _fingerprint_index().get(path, (None,))
+    if entry[:3] == key:
+        return entry[3]
+
+    filehash = _hash_file(path)
+    now = time.time_ns()
+    if now - stat.st_mtime_ns > _RACY_MTIME_NS:
+        indexpath = os.path.join(CACHEDIR, FINGERPRINT_INDEX)
+        with _FINGERPRINTS_LOCK:
+            _fingerprint_index()[path] = key + (filehash,)
+            _FINGERPRINT_UPDATES.setdefault(indexpath, {})[path] = \
+                key + (filehash,)
+            if now - _FINGERPRINT_SAVES.get(indexpath, 0) \
+                    >= _FINGERPRINT_SAVE_INTERVAL_NS:
+                _save_fingerprint_index(indexpath)
+    return filehash
+
+
+class _StoredArray(object):
+
+    """Placeholder for an array stored in a separate file of a cache entry"""
+
+    def __init__(self, index):
+        self.index = index
+
+
+def _dump_pickle(val, path, compress):
+    with open(path, 'wb') as cfile:
+        pickle.dump(val, cfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as cfile:
+        return pickle.load(cfile)
+
+
+def _dump_numpy(val, path, compress):
+    """Stores `val` in the directory `path`: all plain arrays contained in
+    `val` (also in lists, tuples and dicts) are saved as separate .npy files
+    and the remaining structure (including ndarray subclasses) is pickled to
+    MANIFEST. If `compress` is True and the arrays are smaller than
+    COMPRESS_MAX_BYTES, they are stored in a single compressed .npz file
+    instead.
+    """
+    arrays = []
+
+    def extract(leaf):
+        # subclasses such as masked arrays cannot be saved with np.save
+        if type(leaf) not in (np.ndarray, np.memmap) or leaf.dtype.hasobject:
+            return leaf
+        arrays.append(leaf)
+        return _StoredArray(len(arrays) - 1)
+
+    structure = _map_leaves(val, extract)
+    compress = compress and sum(arr.nbytes for arr in arrays) \
+        <= COMPRESS_MAX_BYTES
+
+    mkdir(path)
+    if compress:
+        np.savez_compressed(os.path.join(path, 'arrays.npz'),
+                            *arrays)
+    else:
+        for n, arr in enumerate(arrays):
+            np.save(os.path.join(path, 'arr_{}.npy'.format(n)), arr)
+
+    # the manifest is written last and marks the entry as complete
+    _dump_pickle((compress, structure), os.path.join(path, MANIFEST), False)
+
+
+def _load_numpy(path):
+    """Loads an entry written by `_dump_numpy`. Uncompressed arrays are
+    memory mapped read-only, so they are loaded lazily."""
+    compress, structure = _load_pickle(os.path.join(path, MANIFEST))
+    if compress:
+        with np.load(os.path.join(path, 'arrays.npz')) as npz:
+            arrays = [npz['arr_{}'.format(n)] for n in range(len(npz.files))]
+        load = lambda index: arrays[index]
+    else:
+        load = lambda index: np.load(
+            os.path.join(path, 'arr_{}.npy'.format(index)), mmap_mode='r')
+
+    return _map_leaves(structure, lambda leaf: load(leaf.index)
+                       if isinstance(leaf, _StoredArray) else leaf)
+
+
+# storage name -> (extension, dump(val, path, compress), load(path))
+STORAGES = {'pickle': ('.pkl', _dump_pickle, _load_pickle),
+            'numpy': ('.npd', _dump_numpy, _load_numpy)}
+
+
+def _remove_entry(path):
+    """Removes the cache entry (file or directory) `path`"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    else:
+        os.remove(path)
+
+
+def _atomic_dump(dump, val, path, compress):
+    """Writes the cache entry to a temporary directory next to `path`, from
+    which it is then renamed to `path`. Hence, readers either see the
+    complete entry or none at all.
+    """
+    tmpdir = tempfile.mkdtemp(prefix=os.path.basename(path) + '.',
+                              suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        tmppath = os.path.join(tmpdir, os.path.basename(path))
+        dump(val, tmppath, compress)
+        if os.path.isdir(path) \
+                and not os.path.exists(os.path.join(path, MANIFEST)):
+            # incomplete entry left by a process killed before writing the
+            # manifest; directories cannot be replaced by os.replace
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmppath, path)
+        except OSError as exception:
+            # complete directory entry written concurrently by another thread
+            if exception.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def _entry_lock(path, blocking=True):
+    """Holds an exclusive lock on the cache entry `path` across processes
+    using the file path + '.lock'. Since the lock file may be removed by the
+    holder of the lock (see `_evict_disk`), the lock is only valid if the
+    file still exists after acquiring it.
+
+    :param blocking: Wait for the lock; otherwise, the context yields False
+        if the lock is held by somebody else (default True)
+    :returns: Context manager yielding True if the lock was acquired
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    lockpath = path + '.lock'
+    while True:
+        lockfile = open(lockpath, 'a')
+        try:
+            fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX
+                        | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            lockfile.close()
+            yield False
+            return
+
+        try:
+            valid = os.stat(lockpath).st_ino \
+                == os.fstat(lockfile.fileno()).st_ino
+        except FileNotFoundError:
+            valid = False
+        if valid:
+            break
+        lockfile.close()
+
+    try:
+        yield True
+    finally:
+        fcntl.flock(lockfile.fileno(), fcntl.LOCK_UN)
+        lockfile.close()
+
+
+def _remove_lock(path):
+    """Removes the lock file of the entry `path`, the lock has to be held."""
+    try:
+        os.remove(path + '.lock')
+    except OSError:
+        pass
+
+
+def _freeze(val):
+    """Makes all arrays in `val` (also in lists, tuples and dicts) read-only,
+    since they are shared between all hits of the memory tier."""
+    def freeze(leaf):
+        if isinstance(leaf, np.ndarray):
+            leaf.setflags(write=False)
+        return leaf
+
+    return _map_leaves(val, freeze)
+
+
+class _MemoryCache(object):
+
+    """In-process LRU cache in front of the disk cache, which is limited to
+    CACHE_MEMORY_ENTRIES entries and CACHE_MEMORY_BUDGET bytes. The size of
+    an entry is estimated by the size of its disk entry, since the size of
+    general Python objects (e.g. sparse matrices) is not known. The arrays
+    of cached values are read-only and lists, tuples and dicts are copied on
+    each hit; other objects are shared and must not be modified in place.
+
+    The time of the last access of each entry is recorded, so the disk tier
+    can take hits in memory into account (see `_evict_disk`).
+    """
+
+    def __init__(self):
+        # key -> [value, size, last access (ns), last touch of the disk entry]
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+
+    def get(self, key):
+        """Returns the value for `key` and raises KeyError if not cached"""
+        with self._lock:
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            entry[2] = time.time_ns()
+            val = entry[0]
+        return _map_leaves(val, lambda leaf: leaf)
+
+    def put(self, key, val):
+        """Caches `val`, which has to be stored in the disk entry `key`
+        already, and makes its arrays read-only (see `_freeze`)."""
+        budget = float('inf') if CACHE_MEMORY_BUDGET is None \
+            else CACHE_MEMORY_BUDGET
+        try:
+            size = _entry_size(key)
+        except OSError:
+            return
+        if size > budget or CACHE_MEMORY_ENTRIES == 0:
+            return
+        with self._lock:
+            self._pop(key)
+            now = time.time_ns()
+            self._entries[key] = [_freeze(val), size, now, now]
+            self.nbytes += size
+            while self.nbytes > budget or (
+                    CACHE_MEMORY_ENTRIES is not None
+                    and len(self._entries) > CACHE_MEMORY_ENTRIES):
+                self.nbytes -= self._entries.popitem(last=False)[1][1]
+                _STATS['memory_evictions'] += 1
+
+    def accessed(self, key):
+        """Returns the time of the last access of `key` in ns (0 if it is
+        not cached)"""
+        entry = self._entries.get(key)
+        return 0 if entry is None else entry[2]
+
+    def touch_due(self, key):
+        """Returns True (once per _TOUCH_INTERVAL_NS) if the disk entry of
+        `key` should be touched to make the accesses from this process
+        visible to others."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] - entry[3] < _TOUCH_INTERVAL_NS:
+                return False
+            entry[3] = entry[2]
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        if key in self._entries:
+            self.nbytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+# Temporary files older than that many ns are considered orphaned
+_TMP_MAX_AGE_NS = 3600 * 10**9
+# Minimal time between two updates of the mtime of a disk entry due to hits
+# in memory
+_TOUCH_INTERVAL_NS = 10**9
+_MEMORY_CACHE = _MemoryCache()
+_STATS = Counter()
+
+
+def cache_stats():
+    """Returns the counters of the caches of all `cached_filefunc`-decorated
+    functions in this process: memory_hits, disk_hits, misses,
+    memory_evictions and disk_evictions as well as the current memory_bytes
+    of the in-process cache.
+    """
+    stats = {key: 0 for key in ('memory_hits', 'disk_hits', 'misses',
+                                'memory_evictions', 'disk_evictions')}
+    stats.update(_STATS)
+    stats['memory_bytes'] = _MEMORY_CACHE.nbytes
+    return stats
+
+
+def clear_memory_cache():
+    """Empties the in-process cache and resets the counters."""
+    _MEMORY_CACHE.clear()
+    _STATS.clear()
+
+
+def _entry_size(path):
+    """Returns the size in bytes of the cache entry (file or directory)"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
+
+
+def _touch(path):
+    """Marks the cache entry `path` as used: its mtime is used as access time
+    by the LRU eviction (atime is unreliable on noatime mounts)."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _evict_disk(keep):
+    """Removes the least recently used entries from CACHEDIR until their
+    total size is below CACHE_DISK_BUDGET. The time of the last use is given
+    by the mtime of the entry or the last hit in the memory tier, whichever
+    is later. The entry `keep` and entries locked by others are never
+    removed.
+
+    Additionally, temporary files older than _TMP_MAX_AGE_NS (left behind
+    by killed processes) and lock files of missing entries are removed.
+    """
+    extensions = tuple(ext for ext, _, _ in STORAGES.values())
+    now = time.time_ns()
+    entries = []
+    total = 0
+    for name in os.listdir(CACHEDIR):
+        path = os.path.join(CACHEDIR, name)
+        try:
+            if name.endswith('.tmp'):
+                if now - os.stat(path).st_mtime_ns > _TMP_MAX_AGE_NS:
+                    _remove_entry(path)
+                else:
+                    total += _entry_size(path)
+            elif name.endswith('.lock'):
+                entry = path[:-len('.lock')]
+                with _entry_lock(entry, blocking=False) as locked:
+                    if locked and not os.path.exists(entry):
+                        _remove_lock(entry)
+            elif name.endswith(extensions) and name != FINGERPRINT_INDEX:
+                used = max(os.stat(path).st_mtime_ns,
+                           _MEMORY_CACHE.accessed(path))
+                entries.append((used, _entry_size(path), path))
+        except OSError:
+            # removed by another process in the meantime
+            pass
+
+    if CACHE_DISK_BUDGET is None:
+        return
+
+    total += sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= CACHE_DISK_BUDGET:
+            break
+        if path == keep:
+            continue
+        with _entry_lock(path, blocking=False) as locked:
+            if not locked:
+                continue
+            try:
+                _remove_entry(path)
+            except OSError:
+                continue
+            _remove_lock(path)
+        _MEMORY_CACHE.pop(path)
+        total -= size
+        _STATS['disk_evictions'] += 1
+
+
 def _args_to_dict(func, args):
     """Converts the unnamed arguments of func to a dictionary
 
@@ -87,7 +825,7 @@ def _args_to_dict(func, args):
         value=value in *args
 
     """
-    argnames = func.func_code.co_varnames[:func.func_code.co_argcount]
+    argnames = func.__code__.co_varnames[:func.__code__.co_argcount]
     return {key: val for key, val in zip(argnames, args)}
 
 
@@ -97,23 +835,75 @@ def _to_hashfilename(func, args, kwargs):
     :param func: Function
     :param *args: Named arguments of func
     :param **kwargs: Keyword arguments of func
-    :returns: Proposed filename
+    :returns: Proposed filename (without extension)
 
     """
-    filename_pos = func.func_code.co_varnames.index('filename')
+    filename_pos = func.__code__.co_varnames.index('filename')
     filename = args[filename_pos]
-    filehash = _hash_file(filename)
-    sourcehash = _hash_file(func.func_code.co_filename)
+    filehash = _fingerprint_file(filename)
+    sourcehash = _fingerprint_file(func.__code__.co_filename)
 
     argdict = _args_to_dict(func, args)
     argdict.update(kwargs)
-    argstr = '_'.join("{}={}".format(key, val) for key, val in argdict.iteritems())
+    argstr = '_'.join("{}={}".format(key, val) for key, val in argdict.items())
+
+    rawname = '_'.join((filehash, sourcehash, func.__name__, argstr))
+    # fixed length digest since the arguments might exceed the maximal
+    # file name length
+    return hashlib.blake2b(rawname.encode(), digest_size=16).hexdigest()
+
+
+def _cached_call(func, args, kwargs, cpath, storage, compress):
+    """Returns func(*args, **kwargs) from the memory or disk cache entry
+    `cpath`, or computes and caches it.
+    """
+    _, dump, load = STORAGES[storage]
+    try:
+        val = _MEMORY_CACHE.get(cpath)
+        _STATS['memory_hits'] += 1
+        if _MEMORY_CACHE.touch_due(cpath):
+            _touch(cpath)
+        return val
+    except KeyError:
+        pass
 
-    rawname = '_'.join((filehash, sourcehash, argstr))
-    return base64.urlsafe_b64encode(rawname) + '.pkl'
+    def load_hit():
+        val = load(cpath)
+        _STATS['disk_hits'] += 1
+        _touch(cpath)
+        _MEMORY_CACHE.put(cpath, val)
+        return _freeze(val)
+
+    try:
+        return load_hit()
+    except IOError as exception:
+        if exception.errno != errno.ENOENT:
+            raise
+
+    # Not there? --> Compute it and cache it for further use. Only one
+    # process computes a given entry, the others wait for the lock and load
+    # the result afterwards.
+    mkdir(CACHEDIR)
+    with _entry_lock(cpath):
+        try:
+            return load_hit()
+        except IOError as exception:
+            if exception.errno != errno.ENOENT:
+                raise
+
+        _STATS['misses'] += 1
+        val = func(*args, **kwargs)
+        _atomic_dump(dump, val, cpath, compress)
 
+    # arrays stored by the 'numpy' storage are memory mapped on the next
+    # call, so keeping the freshly computed ones would only pin them
+    if storage != 'numpy':
+        _MEMORY_CACHE.put(cpath, val)
+    _evict_disk(keep=cpath)
+    return _map_leaves(_freeze(val), lambda leaf: leaf)
 
-def cached_filefunc(func):
+
+def cached_filefunc(func=None, storage='pickle', compress=False):
     """Caches the return value for a function which contains a named argument
     `filename` for further use. This can be helpful for creating plots from
     pre-computed data with an intermediate step which still takes very long.
@@ -124,30 +914,156 @@ def cached_filefunc(func):
         * the source file of the function called has changed
         * an argument of the function called is changed
 
+    The content hashes of the data and source files are stored in an index
+    in CACHEDIR together with their size, mtime and inode. As long as these
+    do not change, the files are not read again.
+
+    The return values are cached in two tiers: an in-process LRU cache with
+    a budget of CACHE_MEMORY_BUDGET bytes (cached arrays are read-only, see
+    `_MemoryCache`) in front of the disk cache in CACHEDIR, which is limited to
+    CACHE_DISK_BUDGET bytes by removing the least recently used entries. See
+    `cache_stats` for hit/miss/eviction counters.
+
+    Usage:
+        @cached_filefunc
+        def f(filename): ...
+
+        @cached_filefunc(storage='numpy')
+        def g(filename): ...
+
+    :param storage: 'pickle' to pickle the return value or 'numpy' to store
+        all NumPy arrays in the return value (also in lists, tuples and dicts)
+        as .npy files, which are memory mapped read-only on a cache hit
+        (default 'pickle')
+    :param compress: For storage='numpy', return values with arrays smaller
+        than COMPRESS_MAX_BYTES in total are stored compressed and are loaded
+        into memory (default False)
+
     TODO Detect default values of keyword arguments
     FIXME This is baaaaad hackery!!!
     """
-    @wraps(func)
-    def decorated(*args, **kwargs):
-        # First we try to read the function's return value from cache
-        try:
-            cfilename = _to_hashfilename(func, args, kwargs)
-            with open(os.path.join(CACHEDIR, cfilename), 'rb') as cfile:
-                return pickle.load(cfile)
-        except IOError as exception:
-            if exception.errno != os.errno.ENOENT:
-                raise
+    if func is None:
+        return lambda f: cached_filefunc(f, storage=storage, compress=compress)
 
-        # Not there? --> Compute it and cache it for further use
-        val = func(*args, **kwargs)
+    extension = STORAGES[storage][0]
 
-        mkdir(CACHEDIR)
-        cfilename = _to_hashfilename(func, args, kwargs)
-        with open(os.path.join(CACHEDIR, cfilename), 'wb') as cfile:
-            pickle.dump(val, cfile)
-        return val
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        cpath = os.path.join(CACHEDIR,
+                             _to_hashfilename(func, args, kwargs) + extension)
+        return _cached_call(func, args, kwargs, cpath, storage, compress)
 
-    if 'filename' in func.func_code.co_varnames[:func.func_code.co_argcount]:
+    if 'filename' in func.__code__.co_varnames[:func.__code__.co_argcount]:
         return decorated
     else:
         return func
+
+
+def _hash_value(hasher, val):
+    """Feeds a canonical representation of `val` to `hasher`. Plain arrays
+    are hashed by dtype, shape and raw buffer (which is only copied if the
+    array is not contiguous), scalars by type and value and the items of
+    dicts and sets in an order independent of their insertion order. Other
+    objects (including ndarray subclasses) are hashed by their pickle.
+
+    :param hasher: hashlib hash object
+    :param val: Value to hash
+    """
+    def update(tag, *items):
+        hasher.update(tag)
+        for item in items:
+            item = item.encode() if isinstance(item, str) else item
+            hasher.update(len(item).to_bytes(8, 'little'))
+            hasher.update(item)
+
+    def digest(item):
+        sub = hashlib.blake2b(digest_size=16)
+        _hash_value(sub, item)
+        return sub.digest()
+
+    if val is None or isinstance(val, (bool, int, float, complex)):
+        update(b's', type(val).__name__, repr(val))
+    elif isinstance(val, (str, bytes)):
+        update(b'b' if isinstance(val, bytes) else b'u', val)
+    elif type(val) is np.ndarray or isinstance(val, np.generic):
+        # subclasses (e.g. masked arrays) carry additional state and are
+        # hashed by their pickle below
+        name = type(val).__qualname__
+        val = np.asarray(val)
+        # dtype.str is '|V<itemsize>' for all structured dtypes, the fields
+        # are only contained in str(dtype)
+        update(b'a', name, val.dtype.str, str(val.dtype), repr(val.shape))
+        if val.dtype.hasobject:
+            for item in val.flat:
+                _hash_value(hasher, item)
+        else:
+            hasher.update(np.ascontiguousarray(val).reshape(-1)
+                          .view(np.uint8))
+    elif isinstance(val, (list, tuple)):
+        update(b'l' if isinstance(val, list) else b't', str(len(val)))
+        for item in val:
+            _hash_value(hasher, item)
+    elif isinstance(val, dict):
+        update(b'd', str(len(val)))
+        for item in sorted(digest(key) + digest(value)
+                           for key, value in val.items()):
+            hasher.update(item)
+    elif isinstance(val, (set, frozenset)):
+        update(b'e', str(len(val)))
+        for item in sorted(digest(item) for item in val):
+            hasher.update(item)
+    else:
+        update(b'p', type(val).__qualname__,
+               pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _memoize_key(func, signature, args, kwargs):
+    """Computes the cache key of func(*args, **kwargs) from the function's
+    name, the hash of its source file and all arguments including the
+    default values of those not passed explicitly.
+
+    :returns: Hex digest
+    """
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    hasher = hashlib.blake2b(digest_size=16)
+    _hash_value(hasher, (func.__module__, func.__qualname__,
+                         _fingerprint_file(func.__code__.co_filename)))
+    _hash_value(hasher, list(bound.arguments.items()))
+    return hasher.hexdigest()
+
+
+def memoize(func=None, storage='pickle', compress=False):
+    """Caches the return values of `func` on disk (in CACHEDIR) and in memory
+    using the same two-tier cache as `cached_filefunc`. Contrary to the
+    latter, the function does not need to read a file: the cache key is a
+    hash of the function's source file and of all arguments, where NumPy
+    arrays are hashed by their raw data (see `_hash_value`). Default values
+    are resolved through the signature of `func`, so f(x) and f(x, n=1) hit
+    the same cache entry if n defaults to 1.
+
+    Usage:
+        @memoize
+        def f(matrix, n=1): ...
+
+    :param storage: See `cached_filefunc` (default 'pickle')
+    :param compress: See `cached_filefunc` (default False)
+
+    Note that hashing large arrays costs about as much as reading them, so
+    this only pays off for functions substantially more expensive than that.
+    Also, functions should only depend on their arguments (and not on global
+    state or other source files).
+    """
+    if func is None:
+        return lambda f: memoize(f, storage=storage, compress=compress)
+
+    extension = STORAGES[storage][0]
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        cpath = os.path.join(CACHEDIR, _memoize_key(func, signature, args,
+                                                    kwargs) + extension)
+        return _cached_call(func, args, kwargs, cpath, storage, compress)
+
+    return decorated
@@ -4,42 +4,212 @@
 
 from __future__ import division
 
+import csv
 import fcntl
+import json
+import math
 import os
 import subprocess
 import sys
 import termios
+import threading
 import time
-from collections import Iterable, namedtuple
+from collections import Counter, deque, namedtuple
+from collections.abc import Iterable
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from functools import wraps
 from itertools import islice
 
 import progressbar as pb
 from progressbar import ProgressBar
 
+from . import mkdir  # noqa: F401 (re-exported)
+
+
+# Timers are only recorded (and printed) if this is True when entering them
+TIMING_ENABLED = True
+# Resolution of the histograms used for the percentiles of the timings: the
+# relative error of the percentiles is about 2**(1 / _BUCKETS_PER_OCTAVE) - 1
+_BUCKETS_PER_OCTAVE = 16
+_TIMINGS = {}
+_TIMINGS_LOCK = threading.Lock()
+_SECTIONS = threading.local()
+
+
+class _TimingStats(object):
+
+    """Streaming statistics of the durations (in ns) of a timed section. The
+    percentiles are estimated from a histogram with logarithmic buckets, so
+    the memory used does not grow with the number of measurements.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self._buckets = Counter()
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = duration if self.max is None else max(self.max, duration)
+        self._buckets[int(math.log2(max(duration, 1)) * _BUCKETS_PER_OCTAVE)] \
+            += 1
+
+    def percentile(self, q):
+        """Returns an estimate of the q-th percentile (0 <= q <= 100) of the
+        durations in ns."""
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                break
+        # geometric center of the bucket
+        estimate = 2**((bucket + .5) / _BUCKETS_PER_OCTAVE)
+        return min(max(estimate, self.min), self.max)
+
 
 class Timer(object):
 
-    """Simple timing object. Measure the system time spend in the with-block
-    and prints it to stdout after completion.
+    """Simple timing object. Measure the time spend in the with-block (using
+    time.perf_counter_ns) and prints it to stdout after completion.
+
+    Additionally, all timings are recorded in a process-wide registry under
+    the message of the timer. Timers nested in another timer (in the same
+    thread) are recorded as sections 'outer/inner'. See `timing_stats` and
+    `export_timings` for evaluating the timings and TIMING_ENABLED for
+    switching off all timers.
 
     Usage:
         with Timer('Function took'):
             do_something()
+
+        @Timer('hot function', verbose=False)
+        def hot_function(): ...
+
+    The duration of the last run of the with-block is stored in the
+    attribute `elapsed` (in seconds).
     """
 
-    def __init__(self, msg='Timer'):
+    def __init__(self, msg='Timer', verbose=True):
         """
-        :param msg: Additional message to show after finishing timing.
+        :param msg: Additional message to show after finishing timing and
+            name of the section in the registry of timings
+        :param verbose: Print the time to stdout after completion (default
+            True)
 
         """
         self._msg = msg
-        self._start = None
+        self._verbose = verbose
+        self.elapsed = None
 
     def __enter__(self):
-        self._start = time.time()
+        stack = _section_stack()
+        parent = stack[-1][0] if stack else None
+        if TIMING_ENABLED:
+            path = self._msg if parent is None else parent + '/' + self._msg
+            stack.append((path, time.perf_counter_ns()))
+        else:
+            # placeholder, so __exit__ pops the right entry even if
+            # TIMING_ENABLED is changed inside the block
+            stack.append((parent, None))
+        return self
 
     def __exit__(self, *args):
-        print('{}: {}s'.format(self._msg, time.time() - self._start))
+        stop = time.perf_counter_ns()
+        path, start = _section_stack().pop()
+        if start is None:
+            return
+        with _TIMINGS_LOCK:
+            stats = _TIMINGS.get(path)
+            if stats is None:
+                stats = _TIMINGS[path] = _TimingStats()
+            stats.add(stop - start)
+
+        self.elapsed = (stop - start) / 1e9
+        if self._verbose:
+            print('{}: {}s'.format(self._msg, self.elapsed))
+
+    def __call__(self, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            if not TIMING_ENABLED:
+                return func(*args, **kwargs)
+            with self:
+                return func(*args, **kwargs)
+        return timed
+
+
+def _section_stack():
+    """Returns the list of (path, start) of the currently running timers of
+    this thread, where start is None for timers entered while TIMING_ENABLED
+    was False"""
+    try:
+        return _SECTIONS.stack
+    except AttributeError:
+        _SECTIONS.stack = []
+        return _SECTIONS.stack
+
+
+TIMING_FIELDS = ('section', 'count', 'total', 'mean', 'min', 'max', 'p50',
+                 'p90', 'p99')
+
+
+def timing_stats():
+    """Returns the statistics of all timers recorded so far.
+
+    :returns: Dictionary section -> dict with the entries of TIMING_FIELDS
+        (durations in seconds), where nested sections are given by paths
+        such as 'outer/inner'
+
+    """
+    with _TIMINGS_LOCK:
+        return {path: {'section': path,
+                       'count': stats.count,
+                       'total': stats.total / 1e9,
+                       'mean': stats.total / stats.count / 1e9,
+                       'min': stats.min / 1e9,
+                       'max': stats.max / 1e9,
+                       'p50': stats.percentile(50) / 1e9,
+                       'p90': stats.percentile(90) / 1e9,
+                       'p99': stats.percentile(99) / 1e9}
+                for path, stats in _TIMINGS.items()}
+
+
+def reset_timings():
+    """Removes all recorded timings"""
+    with _TIMINGS_LOCK:
+        _TIMINGS.clear()
+
+
+def export_timings(outfile, fmt=None):
+    """Writes the statistics of `timing_stats` to a file.
+
+    :param outfile: Path or file object opened for writing text
+    :param fmt: 'json' or 'csv' (default None: determined by the extension
+        of outfile)
+
+    """
+    if fmt is None:
+        fmt = os.path.splitext(getattr(outfile, 'name', outfile))[1][1:]
+    if fmt not in ('json', 'csv'):
+        raise ValueError("helpers.py:export_timings: Unknown format {}"
+                         .format(fmt))
+    if isinstance(outfile, str):
+        with open(outfile, 'w', newline='') as handle:
+            return export_timings(handle, fmt)
+
+    rows = sorted(timing_stats().values(), key=lambda row: row['section'])
+    if fmt == 'json':
+        json.dump(rows, outfile, indent=2)
+    else:
+        writer = csv.DictWriter(outfile, fieldnames=TIMING_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
 
 
 def _nr_digits(number):
@@ -97,7 +267,7 @@ class RuntimeSlice(Iterable):
             runtime = time.time() - starttime
             yield runtime, val
             if runtime > self.runtime:
-                raise StopIteration()
+                return
 
 
 def Progress(the_iterable, *args, **kwargs):
@@ -146,12 +316,19 @@ class CountProgress(ProgressBar, Iterable):
     As long as there is no printing involved in do_something, you get
     a nice little progress bar. Works fine on the console as well as all
     ipython interfaces.
+
+    The bar is redrawn at most every `min_interval` seconds. To keep the
+    overhead low in tight loops, the clock is only read every `stride`
+    iterations, where the stride adapts to the duration of the iterations.
+    If the output is not a terminal, the bar is only drawn at the end.
     """
 
-    def __init__(self, iterable, *args, **kwargs):
+    def __init__(self, iterable, *args, min_interval=0.1, **kwargs):
         """
         :param iterable: Iteratable object to loop over
         :param size: Number of characters for the progress bar (default 50).
+        :param min_interval: Minimal time between two updates of the bar in
+            seconds (default 0.1)
 
         """
         if 'max_value' not in kwargs:
@@ -160,15 +337,182 @@ class CountProgress(ProgressBar, Iterable):
 
         super().__init__(*args, **kwargs)
         self._iterable = iterable
+        self._min_interval = min_interval
 
     def __iter__(self):
         """Fetch next object from the iterable"""
         self.start()
+        try:
+            if self.is_terminal:
+                yield from self._iter_throttled()
+            else:
+                yield from self._iterable
+        except GeneratorExit:
+            self.finish(dirty=True)
+            raise
+        self.finish()
+
+    def _iter_throttled(self):
+        # check the clock about 4 times per min_interval, but increase the
+        # stride at most by a factor of 2 per check
+        target = self._min_interval / 4
+        stride = countdown = 1
+        last_check = last_update = time.perf_counter()
         for n, val in enumerate(self._iterable):
-            self.update(n)
+            countdown -= 1
+            if not countdown:
+                now = time.perf_counter()
+                if now - last_update >= self._min_interval:
+                    self.update(n)
+                    last_update = now
+                per_iteration = (now - last_check) / stride
+                stride = max(1, min(2 * stride,
+                                    int(target / max(per_iteration, 1e-9))))
+                countdown = stride
+                last_check = now
             yield val
 
 
+# Chunks of pmap are sized to take about that many seconds
+PMAP_CHUNK_TIME = 0.05
+
+
+def _run_chunk(func, chunk):
+    """Returns [func(x) for x in chunk] and the time it took"""
+    start = time.perf_counter()
+    results = [func(x) for x in chunk]
+    return results, time.perf_counter() - start
+
+
+def _pmap_chunks(func, items, size, workers, executor_class, chunksize,
+                 ordered):
+    """Generator yielding the result lists of the chunks of `items` computed
+    by `workers` workers (see `pmap`)."""
+    # only 2 chunks per worker are submitted in advance, so `items` is
+    # consumed lazily
+    window = 2 * workers
+    remaining = size
+    last_size = 1
+    total_time, total_items = 0., 0
+
+    def next_chunk():
+        nonlocal remaining, last_size
+        nr_items = chunksize
+        if nr_items is None:
+            # aim at PMAP_CHUNK_TIME per chunk, but double the size at most
+            # and keep enough chunks for balancing the load
+            nr_items = 1 if total_time <= 0 \
+                else int(PMAP_CHUNK_TIME * total_items / total_time)
+            nr_items = max(1, min(nr_items, 2 * last_size))
+            if remaining is not None:
+                nr_items = min(nr_items, -(-remaining // (4 * workers)))
+            last_size = max(1, nr_items)
+        chunk = list(islice(items, max(1, nr_items)))
+        if remaining is not None:
+            remaining -= len(chunk)
+        return chunk
+
+    executor = executor_class(workers)
+    pending = deque() if ordered else set()
+    try:
+        while True:
+            while len(pending) < window:
+                chunk = next_chunk()
+                if not chunk:
+                    break
+                future = executor.submit(_run_chunk, func, chunk)
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+            if not pending:
+                return
+
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                pending -= done
+            for future in done:
+                results, runtime = future.result()
+                total_time += runtime
+                total_items += len(results)
+                yield results
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _TimedResults(Iterable):
+
+    """Yields (time since start, value) for the values of `iterable` as
+    expected by TimelyProgress (contrary to RuntimeSlice without stopping
+    after `runtime`)."""
+
+    def __init__(self, iterable, runtime):
+        self._iterable = iterable
+        self.runtime = runtime
+
+    def __iter__(self):
+        starttime = time.time()
+        for val in self._iterable:
+            yield time.time() - starttime, val
+
+
+def pmap(func, iterable, processes=None, threads=False, ordered=True,
+         chunksize=None, progress=True, **kwargs):
+    """Parallel version of map(func, iterable) returning a generator, which
+    yields the results as soon as they are available.
+
+    The items are processed in chunks: unless `chunksize` is given, the
+    chunk size starts at 1 and is adapted to the measured time per item such
+    that chunks take about PMAP_CHUNK_TIME seconds. Only 2 chunks per
+    worker are submitted in advance, so `iterable` may be infinite or a
+    RuntimeSlice: then, no new items are submitted after its runtime has
+    passed. If the generator is closed early, chunks which have not been
+    started yet are cancelled.
+
+    Usage:
+        for result in pmap(simulate, parameters):
+            ...
+
+        results = list(pmap(sample, RuntimeSlice(it.count(), 3600)))
+
+    :param func: Function to apply; it has to be picklable unless
+        threads=True
+    :param iterable: Items to apply `func` to
+    :param processes: Number of workers (default None: os.cpu_count())
+    :param threads: Use a thread pool instead of a process pool, which only
+        pays off if func releases the GIL (default False)
+    :param ordered: Yield the results in the order of `iterable`; otherwise,
+        they are yielded in the order of completion (default True)
+    :param chunksize: Number of items processed per task (default None:
+        adaptive)
+    :param progress: Show a TimelyProgress bar for RuntimeSlices and a
+        CountProgress bar otherwise (default True)
+    :param **kwargs: Passed to the progress bar
+    :returns: Generator of func(x) for x in iterable
+
+    """
+    workers = processes or os.cpu_count() or 1
+    executor_class = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    if isinstance(iterable, RuntimeSlice):
+        items = (val for _, val in iterable)
+        size = None
+    else:
+        items = iter(iterable)
+        size = len(iterable) if hasattr(iterable, '__len__') else None
+
+    chunks = _pmap_chunks(func, items, size, workers, executor_class,
+                          chunksize, ordered)
+    results = (result for chunk in chunks for result in chunk)
+    if not progress:
+        return results
+    elif isinstance(iterable, RuntimeSlice):
+        return iter(TimelyProgress(_TimedResults(results, iterable.runtime),
+                                   **kwargs))
+    else:
+        return iter(CountProgress(results, max_value=size, **kwargs))
+
 
 class AsyncTaskWatcher(object):
     callback_format = namedtuple('CallbackFormat', 'function arguments timeout')
@@ -248,12 +592,3 @@ def get_git_revision_hash():
 
 def get_git_revision_short_hash():
     return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD']).split()[0]
-
-
-def mkdir(dirname):
-    """Create dir if it doesnt exist."""
-    try:
-        os.makedirs(dirname)
-    except OSError as exception:
-        if exception.errno != os.errno.EEXIST:
-            raise